@@ -1,6 +1,7 @@
 from netpyne import specs, sim
-from neuron import h
 from no_utils import plotting
+from no_utils.lattice import LatticeSpec
+from no_utils.no_field import NOField
 import pickle
 import numpy as np
 
@@ -71,20 +72,11 @@ for lam in lam_vals:
     sim.net.createPops()  # instantiate network populations
     sim.net.createCells()  # instantiate network cells based on defined populations
 
-    def get_cell_coords(cell):
-        tags = getattr(cell, 'tags', {}) or (cell.get('tags', {}) if isinstance(cell, dict) else {})
-        x = tags['x']
-        y = tags['y']
-        z = tags['z']
-        # snap to nearest grid node to kill tiny float noise
-        q = lambda v: int(round(v / cube_side_len)) * cube_side_len
-        return (q(x), q(y), q(z))
-
-    # Insert no_voxel point process at soma(0.5) for each
-    voxels = {}
-    for cell in sim.net.cells:
-        vox = h.no_voxel(cell.secs['soma']['hObj'](0.5))
-        voxels[get_cell_coords(cell)] = vox
+    # One array-backed field for the whole lattice, stepped from the first host cell.
+    # Only the region around the center pulse is stepped until NO has spread.
+    lattice = LatticeSpec.from_box((netParams.sizeX, netParams.sizeY, netParams.sizeZ), cube_side_len)
+    voxels = NOField(lattice, active_tol=1e-6)
+    voxels.attach(sim.net.cells[0].secs['soma']['hObj'])
 
     # for cell in sim.net.p:
     #     x, y, z = cell.tags['x'], cell.tags['y'], cell.tags['z']
@@ -103,40 +95,13 @@ for lam in lam_vals:
     # 4. Set voxel parameters
     ###############################################################################
 
-    offsets = {
-        (11, 0, 0): 'conc_xp',
-        (-11, 0, 0): 'conc_xn',
-        (0, 11, 0): 'conc_yp',
-        (0, -11, 0): 'conc_yn',
-        (0, 0, 11): 'conc_zp',
-        (0, 0, -11): 'conc_zn',
-    }
-
-    for vox in voxels:
-        for (dx, dy, dz), pname in offsets.items():
-            neighbor_key = (vox[0] + dx, vox[1] + dy, vox[2] + dz)
-            if neighbor_key in voxels:
-                h.setpointer(voxels[neighbor_key]._ref_conc, pname, voxels[vox])
-            else:
-                h.setpointer(voxels[vox]._ref_conc, pname, voxels[vox])  # boundary = self
-
-    D_phys = 3.3          # µm²/ms
-    dx = 11.0             # µm
-    D = D_phys / (dx**2)  # 1/ms  -> 0.0273
+    D_phys = 3.3          # µm²/ms  -> D = D_phys/11² = 0.0273 /ms per face
     lam_actual = np.log(2)/lam  # decay constant (/ms)
     # lam_actual = 1/lam
-    for vox in voxels.values():
-        vox.dx_pos = D
-        vox.dx_neg = D
-        vox.dy_pos = D
-        vox.dy_neg = D
-        vox.dz_pos = D
-        vox.dz_neg = D
-        vox.lam = lam_actual
-
-    xs = sorted({x for x, _, _ in voxels})
-    ys = sorted({y for _, y, _ in voxels})
-    zs = sorted({z for _, _, z in voxels})
+    voxels.set_diffusion(D_phys)
+    voxels.set_decay(lam_actual)
+
+    xs, ys, zs = voxels.xs, voxels.ys, voxels.zs
 
     center = (xs[len(xs)//2], ys[len(ys)//2], zs[len(zs)//2])
     right = (110, 55, 55)
@@ -152,9 +117,9 @@ for lam in lam_vals:
     assert idx == (len(xs)//2, len(ys)//2, len(zs)//2)
 
     # Example case to drop in a pulse of NO to this cube
-    tvec = h.Vector([0, 420, 470, 570, 620, cfg.duration])
-    fvec = h.Vector([0, 0, 250, 250, 0, 0])
-    fvec.play(voxels[center]._ref_F, tvec, 1)
+    tvec = [0, 420, 470, 570, 620, cfg.duration]
+    fvec = [0, 0, 250, 250, 0, 0]
+    voxels.play_F(center, tvec, fvec, 1)
 
     # fvec_top = h.Vector([0, 0, 0, 0, 0, 0])          # values (nM/ms)
     # fvec_top.play(voxels[top]._ref_F, tvec, 1)
@@ -165,14 +130,15 @@ for lam in lam_vals:
     # t = h.Vector().record(h._ref_t)
     # sim.simData['t'] = t
 
-    for key, vox in voxels.items():
-        vec = h.Vector().record(vox._ref_conc)
-        sim.simData[f"conc_{key}"] = vec
+    voxels.record(cfg.recordStep)
 
     ###############################################################################
     # 6. Run
     ###############################################################################
     sim.runSim()
+
+    # whole grid per sample, [t, iz, iy, ix]
+    sim.simData['no_t'], sim.simData['no_conc'] = voxels.recorded()
     # sim.gatherData()
     # sim.saveData()
 
@@ -181,7 +147,8 @@ for lam in lam_vals:
     # grab the actual concentration vectors for all of these locations
     x_vox_section = {}
     for vox in x_voxels:
-        x_vox_section[(vox, 55, 55)] = sim.simData[f"conc_({vox}, 55, 55)"]
+        ix, iy, iz = lattice.pos_to_idx(vox, 55, 55)
+        x_vox_section[(vox, 55, 55)] = sim.simData['no_conc'][:, iz, iy, ix]
 
     for vox in x_vox_section:
         idx_to_max = np.argmax(x_vox_section[vox])
@@ -207,8 +174,8 @@ if plot_grid:
     plotting.voxel_net(sim)
 
 if plot_conc_heatmap:
-    plotting.conc_heat_map(sim, voxels)
+    plotting.conc_heat_map(sim, lattice)
 
 
 if plot_max_conc_by_dist:
-    plotting.max_conc_by_dist(sim, voxels)
+    plotting.max_conc_by_dist(sim, lattice)
@@ -0,0 +1,389 @@
+from neuron import h
+from scipy import sparse
+from no_utils.lattice import LatticeSpec
+from no_utils.no_field import NOField, MODLattice, DistributedNOField
+import numpy as np
+import gc
+import json
+import os
+import time
+
+try:
+    from neuron import rxd
+except ImportError:
+    rxd = None
+
+"""
+Benchmark of the NO backends on one shared source schedule.
+
+Every backend solves the same lattice problem (reflecting boundaries)
+
+    dC/dt = sum_faces d_face*(C_neighbor - C) - lam*C + F
+
+on n*n*n voxels for each n in GRID_SIZES and each dt in DTS. F follows SOURCES, switched
+at the same times for every backend. The backends are:
+
+- numpy_cnexp / numpy_adi / numpy_spectral: NOField stepped on its own (no NEURON step)
+- numpy_dist: DistributedNOField, z-slabs over all ranks (cnexp)
+- mod_lattice: the compiled no_lattice mechanism (MODLattice), stepped by NEURON's fixed step
+- rxd_native: rxd.Extracellular diffusion plus one decay/source Rate (test_run_no_rxd.py)
+- rxd_operator: d=0 species, lattice operator applied as one sparse mat-vec per step
+
+The cytosolic crxd model of eugenio_test.py diffuses along a 1-D cable rather than a
+3-D lattice, and crxd is the same module as rxd in current NEURON, so the rxd rows
+stand in for it.
+
+The reference is NOField 'spectral' taking one exact step per constant-F interval,
+which is the exact solution of the lattice ODE. Errors are L2 over every sample time,
+relative to the reference norm. Speed is wall time per simulated ms (ms_per_ms), which
+stays comparable when numpy_spectral jumps quiet intervals in one step. Memory is the
+growth of the process RSS over the case (build + run), so it is a lower bound when
+earlier cases left freed memory behind.
+
+Run serial:      nrniv -python benchmark_no_backends.py
+Run on N ranks:  mpiexec -n N nrniv -python -mpi benchmark_no_backends.py
+Backends in DISTRIBUTED run on every rank; the rest run on rank 0 only.
+Results are printed and saved to SAVE_FOLDER/bench_n<nhost>.json.
+"""
+
+# =====================
+# 0) Benchmark settings
+# =====================
+GRID_SIZES = [5, 8, 16, 32, 64]     # voxels per side
+DTS        = [0.025, 0.1, 0.5]      # step sizes (ms)
+BACKENDS   = ['numpy_cnexp', 'numpy_adi', 'numpy_spectral', 'numpy_dist',
+              'mod_lattice', 'rxd_native', 'rxd_operator']
+DISTRIBUTED = ['numpy_dist']
+
+DURATION  = 100.0    # ms
+SAMPLE_DT = 10.0     # ms between compared grid samples
+GRID_UM   = 10.0     # voxel edge (µm)
+D_PHYS    = 3.3      # µm²/ms
+TORT      = 1.6      # tortuosity
+T_HALF    = 1000.0   # NO half-life (ms)
+LAM       = np.log(2) / T_HALF
+
+# (t_on, t_off, (x, y, z) position as fraction of the box, F in nM/ms)
+SOURCES = [(10.0, 40.0, (0.5, 0.5, 0.5), 250.0),
+           (30.0, 60.0, (0.25, 0.75, 0.5), 100.0)]
+
+SAVE_FOLDER = 'simOutput/no_benchmark'
+
+h.load_file('stdrun.hoc')
+pc = h.ParallelContext()
+rank = int(pc.id())
+nhost = int(pc.nhost())
+
+
+# =====================
+# 1) Shared problem
+# =====================
+def set_physics(field):
+    field.set_diffusion(D_PHYS, TORT)
+    field.set_decay(t_half=T_HALF)
+
+
+def segments():
+    # constant-F intervals between every source switch and sample time
+    times = set(np.arange(0.0, DURATION, SAMPLE_DT).tolist()) | {DURATION}
+    for t_on, t_off, _, _ in SOURCES:
+        times.update((t_on, t_off))
+    times = sorted(t for t in times if 0 <= t <= DURATION)
+    return list(zip(times[:-1], times[1:]))
+
+
+def sources_at(spec, t):
+    # flat indices and F (nM/ms) of every source over the interval starting at t
+    idx, val = [], []
+    for t_on, t_off, frac, rate in SOURCES:
+        ix, iy, iz = (int(round(f*(n - 1))) for f, n in zip(frac, (spec.nx, spec.ny, spec.nz)))
+        idx.append(spec.flat(ix, iy, iz))
+        val.append(rate if t_on <= t < t_off else 0.0)
+    return np.array(idx), np.array(val)
+
+
+def reference(spec):
+    # exact solution at the end of every segment: one spectral step per constant-F interval
+    field = NOField(spec, method='spectral')
+    set_physics(field)
+    out = []
+    for t0, t1 in segments():
+        field.set_F_at(*sources_at(spec, t0))
+        field.step(t1 - t0)
+        out.append(field.conc.copy())
+    return np.array(out)
+
+
+def lattice_operator(spec):
+    # H*C = sum_faces d_face*C_neighbor - (sum_faces d_face + lam)*C in lattice flat order
+    faces = spec.face_coefficients(D_PHYS, TORT)
+    e = np.arange(spec.size).reshape(spec.shape)
+    rows, cols, vals = [], [], []
+    diag = np.full(spec.size, LAM)
+    for axis, pos, neg in ((2, 'dx_pos', 'dx_neg'), (1, 'dy_pos', 'dy_neg'), (0, 'dz_pos', 'dz_neg')):
+        lo = [slice(None)] * 3
+        hi = [slice(None)] * 3
+        lo[axis] = slice(None, -1)
+        hi[axis] = slice(1, None)
+        lo, hi = tuple(lo), tuple(hi)
+        a, b = e[lo].ravel(), e[hi].ravel()   # b is a's + neighbor
+        d_pos, d_neg = faces[pos][lo].ravel(), faces[neg][hi].ravel()
+        rows += [a, b]; cols += [b, a]; vals += [d_pos, d_neg]
+        diag[a] += d_pos
+        diag[b] += d_neg
+    off = sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                            shape=(spec.size, spec.size))
+    return (off - sparse.diags(diag)).tocsr()
+
+
+# =====================
+# 2) Backends
+# =====================
+class Unavailable(Exception):
+    """Backend cannot run here (missing mechanism or module, unsupported size); reported as a skip."""
+
+
+class NumpyCase:
+    def __init__(self, spec, dt, method):
+        self.field = NOField(spec, dt=dt, method=method)
+        set_physics(self.field)
+
+    def set_F(self, idx, values):
+        self.field.set_F_at(idx, values)
+
+    def advance(self, t):
+        self.field.advance(t)
+
+    def conc(self):
+        return self.field.conc.copy()
+
+    def close(self):
+        self.field = None
+
+
+class DistCase(NumpyCase):
+    def __init__(self, spec, dt):
+        if spec.nz < nhost:
+            raise Unavailable(f'cannot split {spec.nz} z-planes over {nhost} ranks')
+        self.field = DistributedNOField(pc, spec, dt=dt)
+        set_physics(self.field)
+
+    def conc(self):
+        return self.field.gather_grid()
+
+
+class ModCase:
+    def __init__(self, spec, dt):
+        if not hasattr(h, 'no_lattice'):
+            raise Unavailable('no_lattice mechanism not loaded (nrnivmodl mod_old)')
+        self.sec = h.Section(name='no_bench_host')
+        self.field = MODLattice(spec, self.sec)
+        set_physics(self.field)
+        self.field.set_coefficients(F=0.0, conc0=0.0)
+        h.cvode_active(0)
+        h.dt = dt
+        h.steps_per_ms = 1.0 / dt
+        h.finitialize(0)
+
+    def set_F(self, idx, values):
+        self.field.set_F_at(idx, values)
+
+    def advance(self, t):
+        h.continuerun(t)
+
+    def conc(self):
+        return self.field.conc.copy()
+
+    def close(self):
+        self.field = None
+        self.sec = None
+
+
+class RxDCase:
+    count = 0
+
+    def __init__(self, spec, dt, native):
+        if rxd is None:
+            raise Unavailable('neuron.rxd not available')
+        RxDCase.count += 1
+        self.spec = spec
+        self.native = native
+        # box edges half a voxel outside the lattice, so rxd has exactly nx*ny*nz nodes
+        d = spec.grid
+        n = (spec.nx, spec.ny, spec.nz)
+        lo = [o - d/2 for o in spec.origin]
+        hi = [o + d*(k - 0.5) for o, k in zip(spec.origin, n)]
+        if native:
+            # rxd diffuses with D_eff = d/tortuosity^2 itself, reflecting boundaries by default
+            self.ecs = rxd.Extracellular(*lo, *hi, dx=d, tortuosity=TORT)
+            self.no = rxd.Species(self.ecs, name=f'no_bench{self.count}', charge=0, d=D_PHYS,
+                                  initial=0)
+        else:
+            self.ecs = rxd.Extracellular(*lo, *hi, dx=d)
+            self.no = rxd.Species(self.ecs, name=f'no_bench{self.count}', charge=0, d=0.0,
+                                  initial=0)
+        self.src = rxd.Parameter(self.ecs, name=f'no_bench_src{self.count}', value=0)
+        if self.no[self.ecs].states3d.shape != n:
+            raise Unavailable(f'rxd grid {self.no[self.ecs].states3d.shape} != lattice {n}')
+
+        if native:
+            self.rate = rxd.Rate(self.no, self.src - LAM*self.no)
+        else:
+            # H*C + F lives in src; one Rate adds it to every node
+            self.rate = rxd.Rate(self.no, self.src)
+            self.H = lattice_operator(spec)
+            self.F = np.zeros(spec.size)
+            self.last_t = -1.0
+            self.n_updates = 0    # operator applications, checked against the steps taken
+            # keep the one callback object, so close() can remove exactly what was added
+            self._cb = self.update_work
+            h.CVode().extra_scatter_gather(0, self._cb)
+
+        self.dt = dt
+        h.cvode_active(0)
+        h.dt = dt
+        h.steps_per_ms = 1.0 / dt
+        h.finitialize(0)
+
+    def lattice_view(self, states3d):
+        # rxd arrays are [ix, iy, iz]; the lattice is [iz, iy, ix]
+        return states3d.transpose(2, 1, 0)
+
+    def update_work(self):
+        if h.t == self.last_t:
+            return
+        self.last_t = h.t
+        self.n_updates += 1
+        c = self.lattice_view(self.no[self.ecs].states3d).reshape(-1)
+        self.lattice_view(self.src[self.ecs].states3d)[:] = (self.H @ c + self.F).reshape(self.spec.shape)
+
+    def set_F(self, idx, values):
+        if self.native:
+            ix, iy, iz = self.spec.unflat(idx)
+            self.src[self.ecs].states3d[ix, iy, iz] = values
+        else:
+            self.F[idx] = values
+            self.last_t = -1.0
+
+    def advance(self, t):
+        if self.native:
+            h.continuerun(t)
+            return
+        # the operator only exists through the hook: make sure it ran at every fixed step
+        steps = int(round((t - h.t) / self.dt))
+        n0 = self.n_updates
+        h.continuerun(t)
+        if self.n_updates - n0 < steps:
+            raise RuntimeError(f'operator hook ran {self.n_updates - n0} times over {steps} steps')
+
+    def conc(self):
+        return self.lattice_view(self.no[self.ecs].states3d).copy()
+
+    def close(self):
+        if not self.native:
+            h.CVode().extra_scatter_gather_remove(self._cb)
+            self._cb = None
+        # drop the reaction first and let rxd rebuild its reaction list (finitialize) before
+        # the species and parameter go; releasing them all at once leaves rxd with a stale
+        # reaction that segfaults at the next section change (NEURON 8.2)
+        self.rate = None
+        gc.collect()
+        h.finitialize(0)
+        self.src = self.no = self.ecs = None
+        gc.collect()
+
+
+CASES = {
+    'numpy_cnexp':    lambda spec, dt: NumpyCase(spec, dt, 'cnexp'),
+    'numpy_adi':      lambda spec, dt: NumpyCase(spec, dt, 'adi'),
+    'numpy_spectral': lambda spec, dt: NumpyCase(spec, dt, 'spectral'),
+    'numpy_dist':     DistCase,
+    'mod_lattice':    ModCase,
+    'rxd_native':     lambda spec, dt: RxDCase(spec, dt, native=True),
+    'rxd_operator':   lambda spec, dt: RxDCase(spec, dt, native=False),
+}
+
+
+# =====================
+# 3) Measurement
+# =====================
+def rss_mb():
+    # current resident set size; falls back to the peak where /proc is missing
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench(name, spec, dt, ref):
+    """Build and run one backend; returns its result row on rank 0 (None elsewhere)."""
+    distributed = name in DISTRIBUTED
+    if distributed:
+        pc.barrier()
+    m0 = rss_mb()
+    w0 = time.perf_counter()
+    case = CASES[name](spec, dt)
+    w1 = time.perf_counter()
+    samples = []
+    for t0, t1 in segments():
+        case.set_F(*sources_at(spec, t0))
+        case.advance(t1)
+        samples.append(case.conc())
+    w2 = time.perf_counter()
+    mem = rss_mb() - m0
+    case.close()
+
+    setup, run = w1 - w0, w2 - w1
+    if distributed:
+        # slowest rank sets the pace; memory adds up over ranks
+        setup, run, mem = pc.allreduce(setup, 2), pc.allreduce(run, 2), pc.allreduce(mem, 1)
+    if rank != 0:
+        return None
+
+    err = np.array(samples) - ref
+    return {'backend': name, 'n': spec.nx, 'voxels': spec.size, 'dt': dt,
+            'nhost': nhost if distributed else 1,
+            'setup_s': setup, 'run_s': run, 'ms_per_ms': run * 1e3 / DURATION,
+            'mem_mb': mem,
+            'l2_rel': float(np.linalg.norm(err) / np.linalg.norm(ref)),
+            'max_abs': float(np.abs(err).max())}
+
+
+# =====================
+# 4) Run
+# =====================
+results = []
+skipped = []
+for n in GRID_SIZES:
+    spec = LatticeSpec(n, n, n, GRID_UM)
+    ref = reference(spec) if rank == 0 else None
+    for name in BACKENDS:
+        if name not in DISTRIBUTED and rank != 0:
+            continue
+        for dt in DTS:
+            try:
+                row = bench(name, spec, dt, ref)
+            except Unavailable as e:
+                if rank == 0:
+                    skipped.append({'backend': name, 'n': n, 'dt': dt, 'reason': str(e)})
+                    print(f'  skip {name:15s} n={n:3d} dt={dt}: {e}')
+                break
+            if row is not None:
+                results.append(row)
+                print(f"  {name:15s} n={n:3d} dt={dt:<6} run {row['run_s']:8.3f} s  "
+                      f"{row['ms_per_ms']:10.3f} ms/ms  {row['mem_mb']:8.1f} MB  "
+                      f"L2 {row['l2_rel']:.2e}")
+
+if rank == 0:
+    os.makedirs(SAVE_FOLDER, exist_ok=True)
+    fname = os.path.join(SAVE_FOLDER, f'bench_n{nhost}.json')
+    with open(fname, 'w') as f:
+        json.dump({'nhost': nhost, 'duration': DURATION, 'sources': SOURCES,
+                   'results': results, 'skipped': skipped}, f, indent=1)
+    print(f'Saved {len(results)} results to {fname}')
+
+pc.barrier()
+if nhost > 1:
+    pc.done()
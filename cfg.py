@@ -135,6 +135,33 @@ cfg.intraThalamicIIGain = 1.0
 # ------------------------------------------------------------------------------
 
 cfg.no_t_half_ms = 1000  # half life of no in ms
+cfg.no_tortuosity = 1.0  # extracellular tortuosity, D_eff = D_phys / tortuosity**2
+# spatially varying overrides, e.g. {'box': [[0, 0, 0], [55, 110, 110]], 'tortuosity': 1.6, 't_half_ms': 500}
+cfg.no_regions = []
+cfg.no_backend = 'numpy'  # 'numpy' (NOField arrays) or 'mod' (no_lattice mechanism)
+cfg.no_solver = 'adi'  # 'adi' (implicit, stable at any no_dt), 'spectral' (exact, uniform D/lam) or 'cnexp' (as no_voxel, needs no_dt ~ dt)
+cfg.no_dt = 0.5  # NO field step (ms), independent of cfg.dt; numpy backend only
+cfg.no_theta = 0.5  # adi implicitness: 0.5 Crank-Nicolson-like, 1.0 backward Euler
+cfg.no_sync_dt = cfg.no_dt  # field update / synapse sync interval (ms); cells still step every cfg.dt
+cfg.no_sync_adaptive = False  # widen/narrow the sync interval between no_sync_dt and no_sync_dt_max
+cfg.no_sync_dt_max = 5.0  # ms
+cfg.no_sync_rtol = 0.05  # target max relative NO change at read voxels per sync
+cfg.no_sync_atol = 1e-3  # nM, floor of the relative change denominator
+cfg.no_sync_overlap = False  # nonblocking grid broadcast hidden behind psolve (one-sync lag; needs mpi4py to overlap)
+cfg.no_spike_pops = []  # e.g. ['IRE', 'IREM']: spikes of these pops produce NO in their voxel
+cfg.no_spike_q = 0.1  # nM/ms peak production per spike (alpha kernel)
+cfg.no_spike_tau = 10.0  # ms, time to peak of the per-spike production
+cfg.no_record_dt = 1.0  # keep the whole NO grid every no_record_dt ms (None: don't), saved as no_t / no_conc
+cfg.no_trilinear = False  # synapses sample the 8 surrounding voxels instead of the nearest one
+cfg.no_interp = 'hold'  # synapse NO between updates: 'hold' or 'linear' (ramp to the next field value)
+cfg.no_active_tol = None  # cnexp: only step the region where NO > tol (nM) or F != 0; None = whole grid
+cfg.no_freq_driver = 'batch'  # NO-driven minis: 'batch' (vector draws per sync, BatchStim delivery) or 'mod' (compiled NOPoisson sources)
+cfg.no_syn_pointer = False  # synapses read a rank-local mirror grid through a POINTER instead of no_local
+cfg.no_scatter = True  # sync sends each rank only the voxels its synapses/drivers read, not the whole grid
+cfg.no_sync_compress = False  # send only voxels that changed by > no_sync_tol, cast to no_sync_dtype
+cfg.no_sync_tol = 1e-4  # nM; the worst resulting error is printed at the end of the run
+cfg.no_sync_dtype = 'float32'  # 'float64', 'float32' or 'float16'
+cfg.no_decomposition = False  # split the lattice into z-slabs over MPI ranks (cnexp solver only)
 
 # ------------------------------------------------------------------------------
 # Connectivity
@@ -1,6 +1,9 @@
 from netpyne import sim
 from neuron import h
 from netParams import netParams, cfg
+from no_utils.lattice import LatticeSpec
+from no_utils.no_field import NOField, MODLattice, DistributedNOField
+from no_utils.coupling import run_with_no_coupling, SpikeNOSource, DeltaCodec, SynapseNOScatter, NOMirror, PoissonBatch
 import numpy as np
 
 pc = h.ParallelContext()
@@ -40,48 +43,32 @@ if hasattr(pc, 'set_maxstep'):
 GRID = cfg.cube_side_len      # e.g. 11.0 µm
 BOX  = (cfg.sizeX, cfg.sizeY, cfg.sizeZ)  # e.g. (110,110,110)
 
-def snap(v): return int(round(v/GRID))*int(GRID)
+# --- lattice geometry, shared by every rank and every NO structure below ---
+lattice = LatticeSpec.from_box(BOX, GRID)
+xs, ys, zs = lattice.xs, lattice.ys, lattice.zs
+
+# soma voxel of every local cell, in one vectorized pass (aligned with sim.net.cells)
+cell_vox = lattice.cell_flat(sim.net.cells)
 
 # ----------------------------------------------------------
-# 2) Rank 0: build the entire NO lattice and link neighbors
+# 2) Rank 0: build the NO field over the whole lattice
+#    (or, with cfg.no_decomposition, a z-slab of it on every rank)
 # ----------------------------------------------------------
-voxels_rank0 = {}   # {(x,y,z): hoc no_voxel}
-offsets = {
-    ( GRID, 0, 0): 'conc_xp', (-GRID, 0, 0): 'conc_xn',
-    (0,  GRID, 0): 'conc_yp', (0, -GRID, 0): 'conc_yn',
-    (0, 0,  GRID): 'conc_zp', (0, 0, -GRID): 'conc_zn',
-}
+voxels_rank0 = None   # NOField on rank 0 (dict-like: (x,y,z) -> voxel)
 
 # --- who to target ---
 PRE_OK   = ['IRE', 'IREM']
 POST_OK  = ['TC', 'TCM', 'HTC']
 GABA_MECHS = ['GABAA_NO']  # edit to your actual names
 
-# --- lattice geometry (same as rank-0 lattice) ---
-GRID = cfg.cube_side_len                  # e.g., 11.0
-xs = list(range(0, cfg.sizeX + 1, int(GRID)))
-ys = list(range(0, cfg.sizeY + 1, int(GRID)))
-zs = list(range(0, cfg.sizeZ + 1, int(GRID)))
-nx, ny, nz = len(xs), len(ys), len(zs)
-
-def clamp_idx(i, n): return max(0, min(n-1, i))
-def pos_to_idx(x, y, z):
-    ix = clamp_idx(int(round(x/GRID)), nx-1)
-    iy = clamp_idx(int(round(y/GRID)), ny-1)
-    iz = clamp_idx(int(round(z/GRID)), nz-1)
-    return ix, iy, iz
-def idx3(ix, iy, iz): return (iz*ny + iy)*nx + ix
-
 # --- collect local postsynaptic synapses to be frequency-driven ---
-freq_targets = []   # (syn_hoc, ix, iy, iz)
+freq_targets = []   # (syn_hoc, flat voxel index, driver key)
 
-for cell in sim.net.cells:  # local postsynaptic cells on this rank
+for cell, vox in zip(sim.net.cells, cell_vox):  # local postsynaptic cells on this rank
     post_pop = cell.tags.get('pop')
+    n_cell = 0  # drivers on this cell so far; with the gid this keys the driver's random stream
     if post_pop in POST_OK:
-
-        x, y, z = cell.tags['x'], cell.tags['y'], cell.tags['z']
-        ix, iy, iz = pos_to_idx(x, y, z)   # anchor at soma; OK for first pass
-
+        # anchor at soma; OK for first pass
         for conn in cell.conns:
             preGid = conn['preGid']
             if preGid == 'NetStim':
@@ -92,7 +79,8 @@ for cell in sim.net.cells:  # local postsynaptic cells on this rank
                     for synmech in cell.secs['soma']['synMechs']:
                         if synmech['label'] == 'GABAA_NO':
                             syn = synmech['hObj']
-                            freq_targets.append((syn, ix, iy, iz))
+                            freq_targets.append((syn, vox, (cell.gid << 20) + n_cell))
+                            n_cell += 1
 
 print(f"[rank {rank}] NO-freq targets on this rank: {len(freq_targets)}")
 
@@ -103,57 +91,67 @@ KNO  = 1.0  # nM half-saturation
 W    = 1.0    # NetCon weight (keeps amplitude constant)
 
 def rate_from_NO(NO_nM):
-    return max(0.0, R0 + RMAX * (NO_nM / (KNO + NO_nM)))
-
-freq_drivers = []  # (nc, rng, ix, iy, iz)
-seed_base = 54321 + rank*100000
-
-for k, (syn, ix, iy, iz) in enumerate(freq_targets):
-    nc = h.NetCon(None, syn)                     # programmatic event source
-    nc.weight[0] = W
-    nc.delay     = max(0.1, float(sim.cfg.dt))   # >0 keeps parallel mindelay happy
-    rng = np.random.default_rng(seed_base + k)   # deterministic per rank
-    freq_drivers.append((nc, rng, ix, iy, iz))
-
-if rank == 0:
-    # create a dummy Section host for all voxels so they live on rank 0
-    host_sec = h.Section(name='no_host_rank0')
-
-    # instantiate all voxels on the host section at 0.5
-    xs = list(range(0, BOX[0]+1, int(GRID)))
-    ys = list(range(0, BOX[1]+1, int(GRID)))
-    zs = list(range(0, BOX[2]+1, int(GRID)))
-    for x in xs:
-        for y in ys:
-            for z in zs:
-                pp = h.no_voxel(host_sec(0.5))
-                voxels_rank0[(x,y,z)] = pp
-
-    # link neighbors (all local on rank 0 → safe)
-    for (x,y,z), v in voxels_rank0.items():
-        for (dx,dy,dz), pname in offsets.items():
-            nk = (x+dx, y+dy, z+dz)
-            target = voxels_rank0.get(nk, v)  # self at boundary
-            h.setpointer(target._ref_conc, pname, v)
-
-    # set global physical params on all voxels
+    # NO (nM) array -> rate (Hz) array
+    return np.maximum(0.0, R0 + RMAX * (NO_nM / (KNO + NO_nM)))
+
+freq_vox = np.array([vox for _, vox, _ in freq_targets], dtype=np.int64)
+freq_batch = None  # PoissonBatch,     cfg.no_freq_driver == 'batch'
+freq_sources = []  # (NOPoisson, nc),  cfg.no_freq_driver == 'mod'
+delay = max(0.1, float(sim.cfg.dt))   # >0 keeps parallel mindelay happy
+
+if cfg.no_freq_driver == 'mod':
+    for syn, vox, key in freq_targets:
+        src = h.NOPoisson()                      # compiled source, rate read from the NO mirror
+        src.r0, src.rmax, src.kno = R0, RMAX, KNO
+        src.seed = key                           # reproducible from the gid
+        nc = h.NetCon(src, syn)
+        nc.weight[0] = W
+        nc.delay     = delay
+        freq_sources.append((src, nc))
+elif freq_targets:
+    # one vector draw per sync for every driver on this rank, streams keyed by gid
+    freq_batch = PoissonBatch([key for _, _, key in freq_targets], [syn for syn, _, _ in freq_targets],
+                              rate_from_NO, weight=W, delay=delay)
+
+if rank == 0 or cfg.no_decomposition:
+    # whole lattice in one object (replaces one no_voxel per voxel + setpointer wiring)
+    if cfg.no_decomposition:
+        # each rank owns a z-slab and exchanges one-plane halos (no rank-0 bottleneck);
+        # raises unless cfg.no_solver == 'cnexp'
+        voxels_rank0 = DistributedNOField(pc, lattice, dt=cfg.dt,   # cnexp: small step
+                                          method=cfg.no_solver)
+    elif cfg.no_backend == 'mod':
+        # create a dummy Section host for the no_lattice mechanism
+        host_sec = h.Section(name='no_host_rank0')
+        voxels_rank0 = MODLattice(lattice, host_sec)   # no_lattice mechanism, C loop
+    else:
+        voxels_rank0 = NOField(lattice, dt=cfg.no_dt,  # NumPy arrays, own step
+                               method=cfg.no_solver, theta=cfg.no_theta,
+                               active_tol=cfg.no_active_tol)
+        # advanced by the multi-rate scheduler below, not from the cell step loop
+
+    # set physical params on all voxels in one call each; regions listed in
+    # cfg.no_regions (e.g. a thalamus cube vs a cortex slab) override the defaults
     D_phys = 3.3              # µm^2/ms
-    lam_ms = cfg.no_t_half_ms # or any source you use; lam = ln(2)/t_half
-    lam = np.log(2)/lam_ms
-    D = D_phys / (GRID**2)    # 1/ms
-    for v in voxels_rank0.values():
-        v.dx_pos = v.dx_neg = v.dy_pos = v.dy_neg = v.dz_pos = v.dz_neg = D
-        v.lam = lam
+    tort = np.full(lattice.shape, float(cfg.no_tortuosity))
+    t_half = np.full(lattice.shape, float(cfg.no_t_half_ms))  # lam = ln(2)/t_half
+    for region in cfg.no_regions:
+        mask = lattice.box_mask(*region['box'])
+        tort[mask] = region.get('tortuosity', cfg.no_tortuosity)
+        t_half[mask] = region.get('t_half_ms', cfg.no_t_half_ms)
+    voxels_rank0.set_diffusion(D_phys, tortuosity=tort)   # D = D_phys/tort^2/GRID^2 (1/ms) per face
+    voxels_rank0.set_decay(t_half=t_half)
 
     # optional initial condition / F schedule (center voxel)
     cx, cy, cz = xs[len(xs)//2], ys[len(ys)//2], zs[len(zs)//2]
     center_key = (cx, cy, cz)
-    voxels_rank0[center_key].conc0 = 0  # nM, if you want that initial condition
+    if not cfg.no_decomposition or voxels_rank0.owns(center_key):
+        voxels_rank0[center_key].conc0 = 0  # nM, if you want that initial condition
 
     # # Example: play any F schedule you want (only on rank 0)
-    # tvec = h.Vector([0, 420, 470, 570, 620, cfg.duration])
-    # fvec = h.Vector([0,   0, 2.5, 2.5,   0,           0])  # nM/ms
-    # fvec.play(voxels_rank0[center_key]._ref_F, tvec, 1)
+    # tvec = [0, 420, 470, 570, 620, cfg.duration]
+    # fvec = [0,   0, 2.5, 2.5,   0,           0]  # nM/ms
+    # voxels_rank0.play_F(center_key, tvec, fvec, 1)
 
 pc.barrier()
 
@@ -162,112 +160,115 @@ pc.barrier()
 #    (we’ll set syn.no_local from the broadcasted grid each sync)
 # ----------------------------------------------------------------
 # Gather all local synapses that use the NO-aware mechanism
-syn_list = []  # list of (syn_hoc, ix, iy, iz, weights[8]) for trilinear OR (syn_hoc, ix, iy, iz) for nearest
-use_trilinear = False  # start with nearest-neighbor (fast & simple)
-
-# Build lattice coordinate arrays (same as rank 0):
-xs = list(range(0, BOX[0]+1, int(GRID)))
-ys = list(range(0, BOX[1]+1, int(GRID)))
-zs = list(range(0, BOX[2]+1, int(GRID)))
-nx, ny, nz = len(xs), len(ys), len(zs)
-
-def clamp_idx(i, n): return max(0, min(n-1, i))
-
-for cell in sim.net.cells:  # local postsynaptic cells on this rank
-    x, y, z = cell.tags['x'], cell.tags['y'], cell.tags['z']
-    # snap (or compute trilinear) indices
-    ix = clamp_idx(int(round(x/GRID)), nx-1)
-    iy = clamp_idx(int(round(y/GRID)), ny-1)
-    iz = clamp_idx(int(round(z/GRID)), nz-1)
+syn_list = []  # (syn_hoc, flat voxel index of the soma)
+syn_xyz = []   # soma position of each synapse, for trilinear sampling
+use_trilinear = cfg.no_trilinear  # nearest-neighbor (fast & simple) or 8-corner weights
 
+for cell, vox in zip(sim.net.cells, cell_vox):  # local postsynaptic cells on this rank
     for conn in cell.conns:
         # Normalize synMech to list and check for our NO-enabled syn
         mechs = conn['synMech'] if isinstance(conn['synMech'], list) else [conn['synMech']]
         if 'GABAA_NO' in mechs:
             syn = conn['hSyn']  # POINT_PROCESS MyExp2SynBB_NO with RANGE no_local
-            if use_trilinear:
-                # compute 8-corner weights here (omitted for brevity)
-                # syn_list.append((syn, ix0,iy0,iz0, w8tuple))
-                pass
-            else:
-                syn_list.append((syn, ix, iy, iz))
+            syn_list.append((syn, vox))
+            syn_xyz.append((cell.tags['x'], cell.tags['y'], cell.tags['z']))
+
+# grid -> synapse operator, precomputed once: each sync is a single sparse mat-vec
+syn_xyz = np.array(syn_xyz, dtype=float).reshape(-1, 3)
+syn_op = lattice.interpolation_operator(syn_xyz[:, 0], syn_xyz[:, 1], syn_xyz[:, 2],
+                                        method='trilinear' if use_trilinear else 'nearest')
+syn_prev = np.zeros(len(syn_list))   # NO at every local synapse, at t0 and t1 of a chunk
+syn_next = np.zeros(len(syn_list))
+
+# ranks only ever read the voxels under their own synapses / drivers
+read_vox = np.union1d(syn_op.indices, freq_vox).astype(np.int64)
+
+# rank-local copy of the lattice that synapses / NOPoisson sources read through POINTERs
+lattice_mirror = None
+if (cfg.no_syn_pointer and not use_trilinear) or cfg.no_freq_driver == 'mod':
+    lattice_mirror = NOMirror(lattice.size, cfg.no_interp)
+    lattice_mirror.attach_sources([src for src, _ in freq_sources], freq_vox)
+
+syns = [syn for syn, _ in syn_list]
+syn_mirror = syn_scatter = None
+if cfg.no_syn_pointer and not use_trilinear:
+    # synapses point straight into the lattice mirror
+    syn_mirror = lattice_mirror
+    syn_mirror.attach_synapses(syns, [vox for _, vox in syn_list])
+elif cfg.no_syn_pointer:
+    # 8-corner samples are per synapse: the mirror holds one value per synapse
+    syn_mirror = NOMirror(len(syns), cfg.no_interp)
+    syn_mirror.attach_synapses(syns, range(len(syns)))
+else:
+    syn_scatter = SynapseNOScatter(syns, cfg.no_interp)  # _ref_no_local etc., once
 
 pc.barrier()
 
 # ---------------------------------------------------------
-# 4) Run in chunks; broadcast the grid; update syn.no_local
+# 4) Per-sync work: broadcast the grid; update syn.no_local
 # ---------------------------------------------------------
-tstop = cfg.duration
-sync_dt = cfg.recordStep  # how often to sync NO field (ms)
-t = 0.0
+# Multi-rate: the cells step every cfg.dt, the NO field and the synapses' NO only
+# every cfg.no_sync_dt (= cfg.no_dt by default, i.e. no_dt/dt cell steps per update)
+sync_dt = cfg.no_sync_dt  # how often to sync NO field (ms), independent of cfg.recordStep
 
 # Helper to pack/unpack the grid
 def pack_grid_rank0():
-    # Return a flat float64 array of shape (nx*ny*nz,)
-    arr = np.empty(nx*ny*nz, dtype=np.float64)
-    idx = 0
-    for iz, z in enumerate(zs):
-        for iy, y in enumerate(ys):
-            for ix, x in enumerate(xs):
-                arr[idx] = voxels_rank0[(x,y,z)].conc
-                idx += 1
-    return arr
-
-def update_syns_from_grid(flat):
-    # flat is 1D np.array length nx*ny*nz
-    # nearest-neighbor assignment:
-    for syn, ix, iy, iz in syn_list:
-        idx = (iz*ny + iy)*nx + ix
-        syn.no_local = float(flat[idx])
-
-# Main loop
-while t < tstop - 1e-9:
-    tnext = min(t + sync_dt, tstop)
-
-    # advance simulation to tnext
-    pc.psolve(tnext)   # NEURON parallel solve to tnext
-    t = tnext
-
-    # rank 0 packs grid and broadcasts
-    if rank == 0:
-        grid_flat = pack_grid_rank0()
+    # Return a flat float64 array of shape (nx*ny*nz,): one bulk read of the whole lattice
+    # (NumPy view of NOField, or one no_lattice to_vector for MODLattice)
+    return voxels_rank0.conc.ravel()
+
+def update_mirror(t0, t1, prev, grid):
+    # synapses / sources read it via POINTER: the only per-sync work on their side
+    lattice_mirror.update(t0, t1, prev, grid, read_vox)
+
+def update_syns_from_grid(t0, t1, prev, grid):
+    # prev/grid are 1D np.arrays length nx*ny*nz at t0/t1
+    if syn_mirror is not None and syn_mirror is lattice_mirror:
+        return   # they read the lattice mirror directly
+    # sample them at the synapses (nearest or trilinear), held or ramped over the chunk (cfg.no_interp):
+    syn_prev[:] = syn_op @ prev
+    syn_next[:] = syn_op @ grid
+    if syn_mirror is not None:
+        syn_mirror.update(t0, t1, syn_prev, syn_next)
     else:
-        grid_flat = None
-
-    # Broadcast to all ranks (NEURON supports Python object broadcast in modern versions)
-    try:
-        grid_flat = pc.py_broadcast(grid_flat, 0)  # broadcast from rank 0
-    except:
-        # Fallback: use bytes (older NEURON). You can implement your own broadcast via pc.broadcast if needed.
-        raise RuntimeError("Your NEURON lacks pc.py_broadcast; use bytes-based broadcast here.")
-
-    window_ms = tnext - t
-    window_s = window_ms * 1e-3
-
-    events_this_step = 0
-    for (nc, rng, ix, iy, iz) in freq_drivers:
-        NO = float(grid_flat[idx3(ix, iy, iz)])
-        lam_hz = rate_from_NO(NO)
-        n = rng.poisson(lam_hz * window_s)
-        if n == 0: continue
-        events_this_step += int(n)
-        if n == 1:
-            nc.event(float(t + rng.random() * window_ms))
-        else:
-            U = rng.random(n)
-            for te in (t + U * window_ms):
-                nc.event(float(te))
-
-    # all ranks update their local synapses’ no_local from the received grid
-    update_syns_from_grid(grid_flat)
-
-pc.barrier()
-
-# -----------------------------------
-# 5) Finish and save/plot with NetPyNE
-# -----------------------------------
-sim.runSim()
-sim.gatherData()
-sim.saveData()
-sim.analysis.plotData()  # optional
+        syn_scatter.set(t0, t1, syn_prev, syn_next)   # one PtrVector scatter, no per-synapse loop
+
+def drive_freq_targets(t0, t1, prev, grid):
+    NO_grid = 0.5*(prev + grid) if cfg.no_interp == 'linear' else prev
+    freq_batch.drive(t0, t1, NO_grid[freq_vox])
+
+codec = DeltaCodec(cfg.no_sync_tol, cfg.no_sync_dtype) if cfg.no_sync_compress else None
+
+# activity-dependent production: spikes of cfg.no_spike_pops drive F in their voxels
+before_advance = []
+if cfg.no_spike_pops:
+    is_src = np.array([c.tags.get('pop') in cfg.no_spike_pops for c in sim.net.cells], dtype=bool)
+    spike_source = SpikeNOSource(pc, voxels_rank0,
+                                 [c.gid for c, s in zip(sim.net.cells, is_src) if s],
+                                 cell_vox[is_src] if len(is_src) else [],
+                                 q=cfg.no_spike_q, tau=cfg.no_spike_tau,
+                                 spkt=sim.simData['spkt'], spkid=sim.simData['spkid'], size=lattice.size)
+    before_advance.append(spike_source.update)
+
+listeners = []
+if lattice_mirror is not None:
+    listeners.append(update_mirror)
+if freq_batch is not None:
+    listeners.append(drive_freq_targets)
+# all ranks update their local synapses’ no_local from the received grid
+listeners.append(update_syns_from_grid)
+
+# -----------------------------------------------------------
+# 5) Run (initialize, chunked loop, NO recording), then
+#    gather/save/plot with NetPyNE; replaces sim.runSim()
+# -----------------------------------------------------------
+scheduler = run_with_no_coupling(
+    sim, voxels_rank0, sync_dt, listeners=listeners,
+    # ship each rank only read_vox (the overlapped broadcast always sends the whole grid)
+    reads=read_vox if (cfg.no_decomposition or cfg.no_scatter) and not cfg.no_sync_overlap else None,
+    record_dt=cfg.no_record_dt, plot=True, before_advance=before_advance,
+    pack=pack_grid_rank0, size=lattice.size, codec=codec,
+    adaptive=dict(dt_max=cfg.no_sync_dt_max, rtol=cfg.no_sync_rtol, atol=cfg.no_sync_atol)
+    if cfg.no_sync_adaptive else None,
+    overlap=cfg.no_sync_overlap)
 sim.close()
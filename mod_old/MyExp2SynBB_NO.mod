@@ -3,7 +3,8 @@ TITLE Exp2Syn with NO modulation (drop-in for MyExp2SynBB)
 NEURON {
     POINT_PROCESS MyExp2SynBB_NO
     RANGE tau1, tau2, e, i, g, gmax_base, alpha, K
-    RANGE no_local
+    RANGE no_local, no_slope, no_t0, use_ptr
+    POINTER no_ref, no_ref_next, no_tref0, no_tref1
     NONSPECIFIC_CURRENT i
 }
 
@@ -22,13 +23,20 @@ PARAMETER {
     gmax_base  = 0.001 (uS)  : peak conductance per weight=1 (baseline)
     alpha      = 2e-3 (/nM)  : NO sensitivity (linear/Hill mix below)
     K          = 100 (nM)    : half-saturation (set large to approximate linear)
+    no_slope   = 0 (nM/ms)   : optional ramp of no_local between NO field updates
+    no_t0      = 0 (ms)      : time at which no_local was set
+    use_ptr    = 0           : 0: no_local (+ ramp), 1: hold *no_ref, 2: ramp *no_ref -> *no_ref_next
 }
 
 ASSIGNED {
     v (mV)
     i (nA)
     g (uS)
-    no_local (nM)             : comes from voxel via POINTER
+    no_local (nM)             : set from the NO field at each sync
+    no_ref (nM)               : POINTER into a rank-local mirror of the field (use_ptr > 0)
+    no_ref_next (nM)          : same mirror at the end of the chunk (use_ptr = 2)
+    no_tref0 (ms)             : chunk start / end times shared by all synapses (use_ptr = 2)
+    no_tref1 (ms)
     scale
 }
 
@@ -38,12 +46,23 @@ INITIAL {
 }
 
 BREAKPOINT {
+    LOCAL no
     SOLVE states METHOD cnexp
 
+    : NO seen by the synapse: held at no_local, or ramped between field updates,
+    : or read straight from the mirror grid the sync keeps up to date
+    if (use_ptr == 1) {
+        no = no_ref
+    } else if (use_ptr == 2) {
+        no = no_ref + (no_ref_next - no_ref)*(t - no_tref0)/(no_tref1 - no_tref0)
+    } else {
+        no = no_local + no_slope*(t - no_t0)
+    }
+
     : --- NO modulation law ---
     : Saturating gain: scale = 1 + alpha * (no_local / (K + no_local))
     : If you want linear small-signal, set K very large (e.g., 1e9 nM)
-    scale = 1 + alpha * (no_local/ (K + no_local))
+    scale = 1 + alpha * (no/ (K + no))
 
     g = (B - A) * scale
     i = g * (v - e)
@@ -0,0 +1,93 @@
+TITLE Re-armable vector stream of events
+
+COMMENT
+        VecStim (vecstim.mod) whose vector can be refilled and replayed mid-run: an external
+        event (flag 0, e.g. nc.event(t) from a NetCon(None, batchstim)) restarts the stream
+        at index 0, so only the times >= t of the refilled vector are delivered. Used by
+        no_utils.coupling.PoissonBatch; VecStim itself keeps its usual behavior.
+ENDCOMMENT
+
+NEURON {
+  THREADSAFE
+       ARTIFICIAL_CELL BatchStim 
+}
+
+ASSIGNED {
+	index
+	etime (ms)
+	space
+}
+
+INITIAL {
+	index = 0
+	element()
+	if (index > 0) {
+		if (etime - t>=0) {
+			net_send(etime - t, 1)
+		} else {
+			printf("Event in the stimulus vector at time %g is omitted since has value less than t=%g!\n", etime, t)
+			net_send(0, 2)
+		}
+	}
+}
+
+NET_RECEIVE (w) {
+	if (flag == 1) { net_event(t) }
+	if (flag == 0) {
+		: external event: replay the (refilled) vector from the start
+		index = 0
+	}
+	if (flag == 0 || flag == 1 || flag == 2) {
+		element()
+		if (index > 0) {	
+			if (etime - t>=0) {
+				net_send(etime - t, 1)
+			} else {
+				printf("Event in the stimulus vector at time %g is omitted since has value less than t=%g!\n", etime, t)
+				net_send(0, 2)
+			}
+		}
+	}
+}
+
+VERBATIM
+extern double* vector_vec();
+extern int vector_capacity();
+extern void* vector_arg();
+ENDVERBATIM
+
+PROCEDURE element() {
+VERBATIM	
+  { void* vv; int i, size; double* px;
+	i = (int)index;
+	if (i >= 0) {
+		vv = *((void**)(&space));
+		if (vv) {
+			size = vector_capacity(vv);
+			px = vector_vec(vv);
+			if (i < size) {
+				etime = px[i];
+				index += 1.;
+			}else{
+				index = -1.;
+			}
+		}else{
+			index = -1.;
+		}
+	}
+  }
+ENDVERBATIM
+}
+
+PROCEDURE play() {
+VERBATIM
+	void** vv;
+	vv = (void**)(&space);
+	*vv = (void*)0;
+	if (ifarg(1)) {
+		*vv = vector_arg(1);
+	}
+ENDVERBATIM
+}
+        
+
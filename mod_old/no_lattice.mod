@@ -0,0 +1,266 @@
+
+TITLE Whole lattice of Nitric Oxide Diffusion
+
+COMMENT
+        Same equations as no_voxel (no_diffusion.mod), but one instance owns the
+        entire nx*ny*nz grid in contiguous C arrays and updates it with a single loop
+        per time step, so no per-voxel instances and no setpointer wiring are needed.
+
+        Flat index of voxel (ix, iy, iz) is (iz*ny + iy)*nx + ix, as in init.py.
+        Boundaries reflect (neighbor = self), like the self-pointers used with no_voxel.
+
+        Usage:
+            lat = h.no_lattice(host_sec(0.5))
+            lat.setup(nx, ny, nz)
+            lat.set_field(which, vec)    bulk copy-in, which: 0..5 = dx_pos, dx_neg, dy_pos,
+                                         dy_neg, dz_pos, dz_neg, 6 = lam, 7 = F, 8 = conc0
+            lat.set_all(which, value)    same, one value for every voxel
+            lat.set_conc(i, c) / lat.get_conc(i), set_F / get_F, set_lam / get_lam,
+            set_conc0 / get_conc0, set_D(i, face, d) / get_D(i, face)
+            lat.to_vector(vec)           bulk copy-out of conc (vec is resized to nx*ny*nz)
+ENDCOMMENT
+
+NEURON {
+    THREADSAFE
+    POINT_PROCESS no_lattice
+    RANGE nx, ny, nz
+}
+
+UNITS {
+    (molar) = (1/liter)
+    (nM) = (nanomolar)
+}
+
+ASSIGNED {
+    nx
+    ny
+    nz
+    space
+}
+
+VERBATIM
+#include <stdlib.h>
+#include <math.h>
+#include <string.h>
+
+#ifndef NRN_VERSION_GTEQ_8_2_0
+extern double* vector_vec();
+extern void* vector_arg();
+extern void vector_resize();
+extern int vector_capacity();
+typedef void NoVec;
+#elif NRN_VERSION_GTEQ(9, 0, 0)
+typedef IvocVect NoVec;
+#else
+typedef void NoVec;
+#endif
+
+#define NO_NFIELD 9   /* dx_pos, dx_neg, dy_pos, dy_neg, dz_pos, dz_neg, lam, F, conc0 */
+#define NO_LAM 6
+#define NO_F 7
+#define NO_CONC0 8
+
+typedef struct {
+    int lx, ly, lz, n;
+    double* conc;
+    double* next;
+    double* field[NO_NFIELD];
+} NOLattice;
+
+#define LAT (*((NOLattice**)(&space)))
+
+static void nolat_free(NOLattice* L) {
+    int k;
+    if (!L) return;
+    free(L->conc);
+    free(L->next);
+    for (k = 0; k < NO_NFIELD; ++k) free(L->field[k]);
+    free(L);
+}
+
+static int nolat_check(NOLattice* L, int i) {
+    if (!L) { hoc_execerror("no_lattice: call setup(nx, ny, nz) first", 0); }
+    if (i < 0 || i >= L->n) { hoc_execerror("no_lattice: voxel index out of range", 0); }
+    return i;
+}
+ENDVERBATIM
+
+CONSTRUCTOR {
+VERBATIM
+    LAT = (NOLattice*)0;
+ENDVERBATIM
+}
+
+DESTRUCTOR {
+VERBATIM
+    nolat_free(LAT);
+    LAT = (NOLattice*)0;
+ENDVERBATIM
+}
+
+PROCEDURE setup(nx_, ny_, nz_) {
+VERBATIM
+    NOLattice* L;
+    int k, n;
+    nolat_free(LAT);
+    L = (NOLattice*)calloc(1, sizeof(NOLattice));
+    L->lx = (int)_lnx_; L->ly = (int)_lny_; L->lz = (int)_lnz_;
+    n = L->lx * L->ly * L->lz;
+    L->n = n;
+    L->conc = (double*)calloc(n, sizeof(double));
+    L->next = (double*)calloc(n, sizeof(double));
+    for (k = 0; k < NO_NFIELD; ++k) L->field[k] = (double*)calloc(n, sizeof(double));
+    LAT = L;
+    nx = L->lx; ny = L->ly; nz = L->lz;
+ENDVERBATIM
+}
+
+INITIAL {
+VERBATIM
+    NOLattice* L = LAT;
+    if (L) {
+        int i;
+        for (i = 0; i < L->n; ++i) L->conc[i] = L->field[NO_CONC0][i];
+    }
+ENDVERBATIM
+}
+
+BREAKPOINT {
+    SOLVE advance
+}
+
+PROCEDURE advance() {
+VERBATIM
+    NOLattice* L = LAT;
+    if (L) {
+        int ix, iy, iz, i, nx_ = L->lx, nxy = L->lx * L->ly;
+        double a, b, d, c_inf, *c = L->conc, *cn = L->next, *tmp;
+        double **f = L->field;
+        for (iz = 0; iz < L->lz; ++iz) {
+            for (iy = 0; iy < L->ly; ++iy) {
+                i = iz*nxy + iy*nx_;
+                for (ix = 0; ix < nx_; ++ix, ++i) {
+                    /* a = sum_faces d*C_neighbor + F, b = sum_faces d + lam (boundary faces cancel) */
+                    a = f[NO_F][i];
+                    b = f[NO_LAM][i];
+                    if (ix < nx_ - 1)    { d = f[0][i]; a += d*c[i + 1];   b += d; }
+                    if (ix > 0)          { d = f[1][i]; a += d*c[i - 1];   b += d; }
+                    if (iy < L->ly - 1)  { d = f[2][i]; a += d*c[i + nx_]; b += d; }
+                    if (iy > 0)          { d = f[3][i]; a += d*c[i - nx_]; b += d; }
+                    if (iz < L->lz - 1)  { d = f[4][i]; a += d*c[i + nxy]; b += d; }
+                    if (iz > 0)          { d = f[5][i]; a += d*c[i - nxy]; b += d; }
+                    /* cnexp update with neighbors held over the step */
+                    if (b > 0.) {
+                        c_inf = a/b;
+                        cn[i] = c_inf + (c[i] - c_inf)*exp(-b*dt);
+                    } else {
+                        cn[i] = c[i] + a*dt;
+                    }
+                }
+            }
+        }
+        tmp = L->conc; L->conc = L->next; L->next = tmp;
+    }
+ENDVERBATIM
+}
+
+PROCEDURE set_field(which) {
+VERBATIM
+    NOLattice* L = LAT;
+    int k = (int)_lwhich, i, n;
+    NoVec* vv;
+    double* px;
+    nolat_check(L, 0);
+    if (k < 0 || k >= NO_NFIELD) { hoc_execerror("no_lattice: field index must be 0..8", 0); }
+    vv = vector_arg(2);
+    n = vector_capacity(vv);
+    if (n != L->n) { hoc_execerror("no_lattice: vector size must be nx*ny*nz", 0); }
+    px = vector_vec(vv);
+    for (i = 0; i < n; ++i) L->field[k][i] = px[i];
+ENDVERBATIM
+}
+
+PROCEDURE set_all(which, value) {
+VERBATIM
+    NOLattice* L = LAT;
+    int k = (int)_lwhich, i;
+    nolat_check(L, 0);
+    if (k < 0 || k >= NO_NFIELD) { hoc_execerror("no_lattice: field index must be 0..8", 0); }
+    for (i = 0; i < L->n; ++i) L->field[k][i] = _lvalue;
+ENDVERBATIM
+}
+
+PROCEDURE to_vector() {
+VERBATIM
+    NOLattice* L = LAT;
+    NoVec* vv;
+    nolat_check(L, 0);
+    vv = vector_arg(1);
+    vector_resize(vv, L->n);
+    memcpy(vector_vec(vv), L->conc, L->n*sizeof(double));
+ENDVERBATIM
+}
+
+PROCEDURE set_conc(i, value) {
+VERBATIM
+    LAT->conc[nolat_check(LAT, (int)_li)] = _lvalue;
+ENDVERBATIM
+}
+
+FUNCTION get_conc(i) {
+VERBATIM
+    _lget_conc = LAT->conc[nolat_check(LAT, (int)_li)];
+ENDVERBATIM
+}
+
+PROCEDURE set_conc0(i, value) {
+VERBATIM
+    LAT->field[NO_CONC0][nolat_check(LAT, (int)_li)] = _lvalue;
+ENDVERBATIM
+}
+
+FUNCTION get_conc0(i) {
+VERBATIM
+    _lget_conc0 = LAT->field[NO_CONC0][nolat_check(LAT, (int)_li)];
+ENDVERBATIM
+}
+
+PROCEDURE set_F(i, value) {
+VERBATIM
+    LAT->field[NO_F][nolat_check(LAT, (int)_li)] = _lvalue;
+ENDVERBATIM
+}
+
+FUNCTION get_F(i) {
+VERBATIM
+    _lget_F = LAT->field[NO_F][nolat_check(LAT, (int)_li)];
+ENDVERBATIM
+}
+
+PROCEDURE set_lam(i, value) {
+VERBATIM
+    LAT->field[NO_LAM][nolat_check(LAT, (int)_li)] = _lvalue;
+ENDVERBATIM
+}
+
+FUNCTION get_lam(i) {
+VERBATIM
+    _lget_lam = LAT->field[NO_LAM][nolat_check(LAT, (int)_li)];
+ENDVERBATIM
+}
+
+PROCEDURE set_D(i, face, value) {
+VERBATIM
+    int k = (int)_lface;
+    if (k < 0 || k > 5) { hoc_execerror("no_lattice: face must be 0..5 (xp, xn, yp, yn, zp, zn)", 0); }
+    LAT->field[k][nolat_check(LAT, (int)_li)] = _lvalue;
+ENDVERBATIM
+}
+
+FUNCTION get_D(i, face) {
+VERBATIM
+    int k = (int)_lface;
+    if (k < 0 || k > 5) { hoc_execerror("no_lattice: face must be 0..5 (xp, xn, yp, yn, zp, zn)", 0); }
+    _lget_D = LAT->field[k][nolat_check(LAT, (int)_li)];
+ENDVERBATIM
+}
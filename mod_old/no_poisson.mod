@@ -0,0 +1,107 @@
+
+TITLE NO-modulated Poisson event source
+
+COMMENT
+        Inhomogeneous Poisson spike source whose rate follows the local NO level:
+
+            rate = r0 + rmax * NO/(kno + NO)        (Hz, NO in nM)
+
+        NO is read from no_local (use_ptr = 0) or through the POINTER no_ref into a
+        rank-local mirror of the NO grid (use_ptr = 1), so the rate tracks every sync.
+        Events are generated by thinning: candidates arrive at the bound r0 + rmax and
+        are kept with probability rate/bound, which is exact for any NO(t) >= 0. Events are
+        delivered natively through the NetCons that use this cell as source.
+
+        Random numbers come from a counter-based generator (splitmix64 of seed and draw
+        number), so a stream is reproducible from seed alone, independent of thread,
+        rank or creation order. Set seed from the target's gid.
+
+        Usage:
+            src = h.NOPoisson()
+            src.r0, src.rmax, src.kno, src.seed = 1, 10, 1, gid
+            h.setpointer(mirror._ref_x[vox], 'no_ref', src); src.use_ptr = 1
+            nc = h.NetCon(src, syn)
+ENDCOMMENT
+
+NEURON {
+    THREADSAFE
+    ARTIFICIAL_CELL NOPoisson
+    RANGE r0, rmax, kno, seed, no_local, use_ptr
+    POINTER no_ref
+}
+
+UNITS {
+    (molar) = (1/liter)
+    (nM) = (nanomolar)
+}
+
+PARAMETER {
+    r0       = 1 (/s)      : baseline rate
+    rmax     = 10 (/s)     : additional rate at saturating NO
+    kno      = 1 (nM)      : half-saturation
+    seed     = 0           : stream id, e.g. the target's gid
+    no_local = 0 (nM)      : NO level when use_ptr = 0
+    use_ptr  = 0           : 1: read NO through no_ref
+}
+
+ASSIGNED {
+    no_ref (nM)
+    counter
+    rbound (/ms)
+}
+
+VERBATIM
+#include <math.h>
+#include <stdint.h>
+
+static double nopois_uniform(double stream, double draw) {
+    /* splitmix64 of (stream, draw) -> double in [0, 1) */
+    uint64_t z = (uint64_t)stream * 0x9E3779B97F4A7C15ULL + (uint64_t)draw + 0x632BE59BD9B4E019ULL;
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+    z = z ^ (z >> 31);
+    return (double)(z >> 11) * (1.0/9007199254740992.0);
+}
+ENDVERBATIM
+
+INITIAL {
+    counter = 0
+    rbound = (r0 + rmax)/1000
+    if (rbound > 0) {
+        net_send(interval(), 1)
+    }
+}
+
+NET_RECEIVE (w) {
+    if (flag == 1) {
+        if (uniform()*rbound < rate()) {
+            net_event(t)
+        }
+        net_send(interval(), 1)
+    }
+}
+
+FUNCTION rate() (/ms) {
+    LOCAL no
+    if (use_ptr == 1) {
+        no = no_ref
+    } else {
+        no = no_local
+    }
+    if (no < 0) {
+        no = 0
+    }
+    rate = (r0 + rmax*no/(kno + no))/1000
+}
+
+FUNCTION interval() (ms) {
+    : exponential candidate interval at the bound rate
+    interval = -log(1 - uniform())/rbound
+}
+
+FUNCTION uniform() {
+VERBATIM
+    _luniform = nopois_uniform(seed, counter);
+ENDVERBATIM
+    counter = counter + 1
+}
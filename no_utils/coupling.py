@@ -0,0 +1,587 @@
+from neuron import h
+from scipy.stats import poisson
+import numpy as np
+
+try:
+    from mpi4py import MPI   # only for the overlapped (nonblocking) broadcast
+except ImportError:
+    MPI = None
+
+"""
+Coupling between the NO field (rank 0) and the cells (all ranks).
+
+MultiRateScheduler runs the network in pc.psolve chunks of no_dt. At the start of each
+chunk rank 0 advances the field to the end of the chunk, the grid is broadcast, and
+every listener gets (t0, t1, grid_t0, grid_t1) to set up the synapses for the chunk,
+so the cells integrate at cfg.dt while the field is only evaluated every no_dt.
+
+Given the grid size, the broadcast sends the raw float64 buffer with pc.broadcast into
+two preallocated h.Vectors used in turn (the previous grid stays valid for one more
+chunk), so there is no pickling and no allocation per sync.
+
+After register_reads() rank 0 instead sends each rank only the voxels its synapses and
+drivers read (one py_alltoall of packed values), so the traffic scales with the synapse
+footprint rather than the lattice size; each rank patches them into its grid buffers.
+
+A DeltaCodec (cfg.no_sync_compress) makes either path send only the voxels that moved by
+more than a tolerance since they were last sent, optionally cast to float32/float16.
+Rank 0 tracks what every receiver holds, so the worst synapse-side error is known exactly.
+
+With adaptive=dict(dt_max=..., rtol=..., atol=...) the sync interval is chosen per chunk
+between no_dt and dt_max (in multiples of no_dt) from the largest relative change of NO
+at the voxels the ranks read. A chunk that moved by more than rtol is rejected before the
+cells see it: the field is restored and the chunk redone at the floor interval (no_dt, or
+the network's minimum NetCon delay if larger), so a source switching on mid-chunk costs
+one retry instead of a coarse step. Quiet chunks at most double the interval. The
+decision is one scalar allreduce, so all ranks agree.
+
+With overlap=True the broadcast of the next grid is posted as a nonblocking MPI Ibcast
+(mpi4py) before the chunk is integrated and only completed after it, so its latency
+hides behind pc.psolve. The listeners then work one sync behind: over [t, t + no_dt]
+they get the grids of t - no_dt and t, which is safe while no_dt stays within the
+minimum NetCon delay. Without mpi4py (or on one rank) the same schedule runs blocking.
+
+SpikeNOSource turns the spikes of chosen source cells into production F: at every sync the
+spikes recorded since the last one are collected, binned to voxels and fed to an alpha
+filter kept per voxel, before the field is advanced over the next chunk.
+
+run_with_no_coupling() wraps all of it for a NetPyNE model: initialize, the chunked run,
+NO recording at its own interval, then gather/save, in place of sim.runSim().
+
+With a DistributedNOField every rank advances its own slab and the broadcast is
+replaced by reading just the voxels the local synapses need. A MODLattice is stepped by
+NEURON with the cells instead, so its grids reach the listeners one sync behind.
+"""
+
+
+class MultiRateScheduler:
+    """Advance field every no_dt and the cells every dt; listeners update synapses per chunk."""
+
+    def __init__(self, pc, field, no_dt, pack=None, size=None, codec=None, adaptive=None,
+                 overlap=False):
+        self.pc = pc
+        self.rank = int(pc.id())
+        self.nhost = int(pc.nhost())
+        self.field = field                  # only used on rank 0, unless distributed
+        self.distributed = getattr(field, 'distributed', False)
+        self.no_dt = no_dt
+        self.pack = pack or (lambda: np.array(field.conc, dtype=np.float64).ravel())
+        self.listeners = []                 # fn(t0, t1, grid_t0, grid_t1)
+        self.before_advance = []            # fn(t0, t1), all ranks, before the field steps
+        self.n_updates = 0
+        self.bytes_sent = 0                 # grid payload sent by rank 0, all syncs
+        self.codec = codec
+        self.adaptive = adaptive            # None: fixed no_dt, else dict(dt_max, rtol, atol)
+        self.t_synced = 0.0
+        self.n_rejected = 0                 # adaptive chunks redone at the floor interval
+        self._watch = None                  # voxels read on this rank (None: all)
+        self.overlap = overlap
+        self._bufs = self._views = None
+        if size is not None and not self.distributed:
+            # two grids in use by the listeners, plus one in flight when overlapping
+            self._bufs = [h.Vector(int(size)) for _ in range(3 if overlap else 2)]
+            self._views = [b.as_numpy() for b in self._bufs]
+            self._cur = 0
+        self._need = self._needs = None     # need-based scatter, see register_reads
+
+    def add_listener(self, fn):
+        self.listeners.append(fn)
+
+    def add_before_advance(self, fn):
+        self.before_advance.append(fn)
+
+    def register_reads(self, flat_idx):
+        """Setup (collective): from now on each rank only receives the voxels it reads."""
+        self._watch = np.unique(np.asarray(flat_idx, dtype=np.int64))
+        if self.distributed:
+            self.field.register_reads(flat_idx)
+            return
+        if self._bufs is None:
+            raise ValueError("register_reads needs the grid size (MultiRateScheduler(..., size=...))")
+        self._need = np.unique(np.asarray(flat_idx, dtype=np.int64))
+        self._needs = self.pc.py_gather(self._need, 0)  # per-rank index sets, rank 0 only
+
+    def broadcast_grid(self):
+        if self.distributed:
+            return self.field.read_grid()   # each rank reads its synapses' voxels from the owners
+        if self._need is not None:
+            return self.scatter_grid()
+        if self._bufs is None:
+            if self.codec is not None:
+                raise ValueError("a sync codec needs the grid size (MultiRateScheduler(..., size=...))")
+            grid = self.pack() if self.rank == 0 else None
+            if self.rank == 0:
+                self.bytes_sent += grid.nbytes * (self.nhost - 1)
+            return self.pc.py_broadcast(grid, 0)
+        buf, view = self._bufs[self._cur], self._views[self._cur]
+        self._cur ^= 1
+        if self.codec is not None:
+            payload = None
+            if self.rank == 0:
+                view[:] = self.pack()
+                payload = self.codec.encode('all', view)
+                self.bytes_sent += self.codec.nbytes(payload) * (self.nhost - 1)
+            payload = self.pc.py_broadcast(payload, 0)
+            if self.rank != 0:
+                view[:] = self.codec.decode('all', payload, view.size)
+            return view
+        if self.rank == 0:
+            view[:] = self.pack()
+            self.bytes_sent += view.nbytes * (self.nhost - 1)
+        self.pc.broadcast(buf, 0)           # raw buffer, received in place on the other ranks
+        return view
+
+    def scatter_grid(self):
+        view = self._views[self._cur]
+        self._cur ^= 1
+        out = [None] * self.nhost
+        if self.rank == 0:
+            view[:] = self.pack()
+            for r in range(1, self.nhost):
+                if len(self._needs[r]):
+                    vals = view[self._needs[r]]
+                    out[r] = vals if self.codec is None else self.codec.encode(r, vals)
+                    self.bytes_sent += vals.nbytes if self.codec is None else self.codec.nbytes(out[r])
+        got = self.pc.py_alltoall(out)[0]
+        if self.rank != 0 and got is not None:
+            # voxels nobody here reads keep stale values
+            view[self._need] = got if self.codec is None else self.codec.decode(0, got, self._need.size)
+        return view
+
+    def report(self):
+        """One-line sync summary (meaningful on rank 0, which does the sending)."""
+        msg = f"NO sync: {self.n_updates} updates, {self.bytes_sent/1e6:.3f} MB sent"
+        if self.adaptive is not None and self.n_updates:
+            msg += f", mean interval {self.t_synced/self.n_updates:.3g} ms, {self.n_rejected} redone"
+        if self.codec is not None:
+            msg += f", max |error| at receivers {self.codec.max_error:.3g} nM (bound {self.codec.bound():.3g})"
+        return msg
+
+    def change(self, prev, grid):
+        """Largest relative NO change from prev to grid at the read voxels, over all ranks (collective)."""
+        p, g = (prev, grid) if self._watch is None else (prev[self._watch], grid[self._watch])
+        rel = float(np.max(np.abs(g - p) / (np.abs(p) + self.adaptive['atol']))) if p.size else 0.0
+        return self.pc.allreduce(rel, 2)    # max over ranks: every rank makes the same choice
+
+    def min_interval(self):
+        """Floor of the adaptive interval: no_dt, or the minimum NetCon delay if larger (collective)."""
+        mindelay = self.pc.set_maxstep(10) if self.nhost > 1 else 0.0
+        n = max(1, int(np.ceil(mindelay / self.no_dt - 1e-9)))
+        n_max = max(1, int(round(self.adaptive['dt_max'] / self.no_dt)))
+        return self.no_dt * min(n, n_max)
+
+    def next_interval(self, dt, rel, floor):
+        """Interval after an accepted chunk of length dt whose relative change was rel."""
+        factor = 2.0 if rel == 0 else min(2.0, 0.9 * self.adaptive['rtol'] / rel)
+        n_max = max(1, int(round(self.adaptive['dt_max'] / self.no_dt)))
+        n_min = int(round(floor / self.no_dt))
+        return self.no_dt * min(n_max, max(n_min, int(dt * factor / self.no_dt + 1e-9)))
+
+    def _post(self, k):
+        """Start broadcasting the packed grid into buffer k; returns the request (None if done)."""
+        if self.rank == 0:
+            self._views[k][:] = self.pack()
+            self.bytes_sent += self._views[k].nbytes * (self.nhost - 1)
+        if MPI is None or self.nhost == 1:
+            self.pc.broadcast(self._bufs[k], 0)
+            return None
+        return MPI.COMM_WORLD.Ibcast(self._views[k], root=0)
+
+    def _run_overlapped(self, tstop, t):
+        if self._bufs is None or self._need is not None or self.codec is not None \
+                or self.adaptive is not None:
+            raise ValueError("overlap needs the raw broadcast path (size given; no reads/codec/adaptive)")
+        req = self._post(0)
+        if req is not None:
+            req.Wait()
+        older = current = 0                 # grids at t - no_dt and t (both t at the start)
+        while t < tstop - 1e-9:
+            tnext = min(t + self.no_dt, tstop)
+            for fn in self.before_advance:
+                fn(t, tnext)
+            if self.rank == 0:
+                self.field.advance(tnext)
+            pending = ({0, 1, 2} - {older, current}).pop()
+            req = self._post(pending)       # grid(tnext) travels while the cells integrate
+            self.n_updates += 1
+            self.t_synced += tnext - t
+
+            for fn in self.listeners:
+                fn(t, tnext, self._views[older], self._views[current])
+
+            self.pc.psolve(tnext)
+            if req is not None:
+                req.Wait()
+            older, current, t = current, pending, tnext
+        return t
+
+    def run(self, tstop, t=0.0):
+        if self.overlap:
+            return self._run_overlapped(tstop, t)
+        prev = self.broadcast_grid()
+        owner = self.rank == 0 or self.distributed
+        floor = dt = self.no_dt
+        if self.adaptive is not None:
+            floor = dt = self.min_interval()
+        while t < tstop - 1e-9:
+            tnext = min(t + dt, tstop)
+            for fn in self.before_advance:
+                fn(t, tnext)
+
+            # field leads the cells by one chunk so synapses can interpolate, not extrapolate
+            coarse = self.adaptive is not None and tnext - t > floor + 1e-9
+            snap = self.field.snapshot() if coarse and owner else None
+            if owner:
+                self.field.advance(tnext)
+            grid = self.broadcast_grid()
+            if self.adaptive is not None:
+                rel = self.change(prev, grid)
+                if coarse and rel > self.adaptive['rtol']:
+                    # too coarse: undo the chunk before the cells run it, redo it at the floor
+                    if owner:
+                        self.field.restore(snap)
+                    if self._bufs is not None:
+                        self._cur ^= 1      # reuse the buffer, prev must stay intact
+                    self.n_rejected += 1
+                    dt = floor
+                    continue
+                dt = self.next_interval(tnext - t, rel, floor)
+            self.n_updates += 1
+            self.t_synced += tnext - t
+
+            for fn in self.listeners:
+                fn(t, tnext, prev, grid)
+
+            self.pc.psolve(tnext)
+            prev, t = grid, tnext
+        return t
+
+
+def run_with_no_coupling(sim, field, sync_dt, listeners=(), reads=None, record_dt=None,
+                         save=True, plot=False, before_advance=(), **scheduler_kw):
+    """Run a NetPyNE model coupled to an NO field and gather/save it (replaces sim.runSim()).
+
+    field is the NO lattice on rank 0 (None elsewhere), or a DistributedNOField on every
+    rank; the cells step every cfg.dt while the field and the listeners are updated every
+    sync_dt. reads: voxels this rank's listeners read (enables need-based scatter).
+    before_advance: fn(t0, t1) hooks run on every rank before the field steps (e.g.
+    SpikeNOSource.update). record_dt: keep the full grid every record_dt ms as allSimData['no_t'] / ['no_conc']
+    (independent of cfg.recordStep). Returns the scheduler (n_updates, report()).
+    """
+    pc = sim.pc
+    scheduler = MultiRateScheduler(pc, field, sync_dt, **scheduler_kw)
+    if reads is not None:
+        scheduler.register_reads(reads)
+    for fn in listeners:
+        scheduler.add_listener(fn)
+    for fn in before_advance:
+        scheduler.add_before_advance(fn)
+
+    rec_t, rec = [], []
+    if record_dt is not None:
+        next_rec = [0.0]   # next recording time
+
+        def record(t0, t1, prev, grid):
+            # the field has already been advanced to t1 (it leads the cells by one chunk),
+            # except a lattice stepped with the cells (MODLattice), which is still at t0
+            t_grid = t0 if getattr(field, 'steps_with_cells', False) else t1
+            if t_grid < next_rec[0] - 1e-9:
+                return
+            next_rec[0] = (np.floor(t_grid / record_dt + 1e-9) + 1) * record_dt
+            if scheduler.distributed:
+                full = field.gather_grid()  # collective
+            else:
+                full = field.conc if scheduler.rank == 0 else None
+            if scheduler.rank == 0:
+                rec_t.append(t_grid)
+                rec.append(np.array(full, dtype=np.float32).reshape(field.shape))
+        scheduler.add_listener(record)
+
+    if scheduler.rank == 0:
+        print(f"\nRunning with NO coupling for {sim.cfg.duration:g} ms (sync every {sync_dt:g} ms)...")
+    sim.timing('start', 'runTime')
+    sim.preRun()   # as sim.runSim(): h.dt, globals, initV handlers, setup_transfer, stim seeds
+    h.finitialize(float(sim.cfg.hParams['v_init']))   # also re-initializes the NO field
+    scheduler.run(sim.cfg.duration)
+    pc.barrier()
+    sim.timing('stop', 'runTime')
+    if scheduler.rank == 0:
+        print(scheduler.report())
+
+    sim.gatherData()
+    if scheduler.rank == 0 and record_dt is not None:
+        sim.allSimData['no_t'] = np.array(rec_t)
+        sim.allSimData['no_conc'] = np.array(rec)
+    if save:
+        sim.saveData()
+    if plot:
+        sim.analysis.plotData()
+    return scheduler
+
+
+class SpikeNOSource:
+    """Activity-dependent NO production: source cells' spikes -> alpha-filtered F per voxel.
+
+    Each spike at ts adds q * (t - ts)/tau * exp(1 - (t - ts)/tau) nM/ms to F of its cell's
+    voxel (peak q at tau after the spike). The filter is the exact two-state recursion
+    x' = -x/tau, y' = (x - y)/tau with F = q*e*y, advanced only at voxels that are active,
+    so a sync costs O(new spikes + active voxels), not O(cells) or O(lattice).
+
+    gids / vox: this rank's source cells and their flat voxel indices. spkt / spkid: the
+    rank's spike recording vectors (sim.simData['spkt'], ['spkid'] after sim.setupRecording());
+    new entries are read since the last sync, so NetPyNE's own spike record stays intact
+    (NEURON keeps one spike_record slot per gid). Collective: every rank calls update();
+    F is set on rank 0, or on every rank for a DistributedNOField.
+    """
+
+    def __init__(self, pc, field, gids, vox, q, tau, spkt, spkid, tol=1e-9, size=None):
+        self.pc = pc
+        self.rank = int(pc.id())
+        self.field = field
+        self.distributed = getattr(field, 'distributed', False)
+        self.q, self.tau, self.tol = q, tau, tol
+        order = np.argsort(np.asarray(gids, dtype=np.int64))
+        self._gids = np.asarray(gids, dtype=np.int64)[order]
+        self._vox = np.asarray(vox, dtype=np.int64)[order]
+        self.tvec, self.idvec = spkt, spkid
+        self._read = 0   # entries of tvec / idvec already folded in
+        self.n_spikes = 0
+        self.t_last = 0.0
+        if self.rank == 0 or self.distributed:
+            n = field.size if size is None else size
+            self.x, self.y = np.zeros(n), np.zeros(n)
+            self.active = np.empty(0, dtype=np.int64)
+
+    def _collect(self):
+        # spikes recorded on this rank since the last call, as (times, voxels) everywhere needed
+        n = int(self.tvec.size())
+        if n < self._read:
+            self._read = 0   # cleared by finitialize
+        ts = self.tvec.as_numpy()[self._read:n].copy()
+        ids = self.idvec.as_numpy()[self._read:n].astype(np.int64)
+        self._read = n
+        pos = np.minimum(np.searchsorted(self._gids, ids), max(self._gids.size - 1, 0))
+        mine = self._gids[pos] == ids if self._gids.size else np.zeros(ids.size, dtype=bool)
+        ts, vox = ts[mine], self._vox[pos[mine]]
+        parts = self.pc.py_allgather((ts, vox)) if self.distributed else self.pc.py_gather((ts, vox), 0)
+        if parts is None:
+            return None, None
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def update(self, t0, t1):
+        """Fold in the spikes up to t0 and set F for the chunk [t0, t1] (held at its t0 value)."""
+        ts, vox = self._collect()
+        if ts is None:
+            return
+        self.n_spikes += ts.size
+        x, y, act = self.x, self.y, self.active
+        dt = t0 - self.t_last
+        a = np.exp(-dt / self.tau)
+        y[act] = a * (y[act] + dt / self.tau * x[act])
+        x[act] *= a
+        if ts.size:
+            d = t0 - ts                     # each spike enters with its own age
+            ak = np.exp(-d / self.tau)
+            np.add.at(x, vox, ak)
+            np.add.at(y, vox, ak * d / self.tau)
+            act = np.union1d(act, vox)
+        self.t_last = t0
+
+        keep = (x[act] > self.tol) | (y[act] > self.tol)
+        gone = act[~keep]
+        x[gone] = y[gone] = 0.0
+        self.field.set_F_at(act, np.where(keep, self.q * np.e * y[act], 0.0))
+        self.active = act[keep]
+
+
+class DeltaCodec:
+    """Delta + reduced-precision encoding of grid values for one sender and its receivers.
+
+    encode(key, values) sends the positions whose value moved by more than tol since it
+    was last sent to receiver key, cast to dtype; decode(key, payload, n) patches the
+    receiver's mirror in place and returns it. The sender keeps the exact copy of what
+    each receiver holds, so max_error is the true worst error seen by any receiver.
+    """
+
+    def __init__(self, tol=0.0, dtype='float32'):
+        self.tol = float(tol)
+        self.dtype = np.dtype(dtype)
+        self.max_error = 0.0
+        self._sent = {}     # sender: key -> values as the receiver has them
+        self._mirror = {}   # receiver: key -> patched values
+
+    def encode(self, key, values):
+        sent = self._sent.get(key)
+        if sent is None:
+            sent = self._sent[key] = np.zeros(values.size)
+        pos = np.flatnonzero(np.abs(values - sent) > self.tol)
+        q = values[pos].astype(self.dtype)
+        sent[pos] = q
+        if values.size:
+            self.max_error = max(self.max_error, float(np.abs(values - sent).max()))
+        return pos.astype(np.int32), q
+
+    def decode(self, key, payload, n):
+        mirror = self._mirror.get(key)
+        if mirror is None:
+            mirror = self._mirror[key] = np.zeros(n)
+        pos, q = payload
+        mirror[pos] = q
+        return mirror
+
+    @staticmethod
+    def nbytes(payload):
+        return payload[0].nbytes + payload[1].nbytes
+
+    def bound(self):
+        """A priori bound: tol for unsent voxels, half an ulp at the largest value seen for sent ones."""
+        peak = max((float(np.abs(v).max()) for v in self._sent.values() if v.size), default=0.0)
+        quant = 0.0 if self.dtype == np.float64 else float(np.spacing(self.dtype.type(peak))) / 2
+        return max(self.tol, quant)
+
+
+class SynapseNOScatter:
+    """no_local (and no_slope/no_t0 for 'linear') of many MyExp2SynBB_NO, set in one scatter each.
+
+    The _ref_ pointers are registered once in h.PtrVectors, in the order of syns;
+    set() then writes a whole chunk's values with PtrVector.scatter from a reused buffer.
+    """
+
+    def __init__(self, syns, interp='hold'):
+        self.n = len(syns)
+        self.interp = interp
+        names = ('no_local', 'no_slope', 'no_t0') if interp == 'linear' else ('no_local',)
+        self.ptrs = {}
+        for name in names:
+            ptr = h.PtrVector(max(self.n, 1))
+            for i, syn in enumerate(syns):
+                ptr.pset(i, getattr(syn, '_ref_' + name))
+            self.ptrs[name] = ptr
+        self._vec = h.Vector(self.n)
+        self._buf = self._vec.as_numpy()
+
+    def _scatter(self, name, values):
+        self._buf[:] = values
+        self.ptrs[name].scatter(self._vec)
+
+    def set(self, t0, t1, prev, grid):
+        """Same as set_syn_no for every synapse; prev/grid are per-synapse NO at t0/t1."""
+        if not self.n:
+            return
+        self._scatter('no_local', prev)
+        if self.interp == 'linear':
+            self._scatter('no_slope', (grid - prev) / (t1 - t0))
+            self._scatter('no_t0', t0)
+
+
+class NOMirror:
+    """Rank-local copy of the field that mechanisms read through POINTERs.
+
+    MyExp2SynBB_NO synapses point at cur[target] ('hold', use_ptr = 1), plus next[target]
+    and the chunk times ('linear', use_ptr = 2); NOPoisson sources point at cur[target].
+    The pointers are set once, so a sync only copies the received values into the
+    mirror; its cost no longer depends on the number of synapses or sources.
+    """
+
+    def __init__(self, size, interp='hold'):
+        self.interp = interp
+        self.cur, self.next, self.times = h.Vector(int(size)), h.Vector(int(size)), h.Vector(2)
+        self._cur, self._next, self._times = (v.as_numpy() for v in (self.cur, self.next, self.times))
+        self._times[:] = (0.0, 1.0)
+
+    def attach_synapses(self, syns, targets):
+        for syn, k in zip(syns, targets):
+            k = int(k)
+            h.setpointer(self.cur._ref_x[k], 'no_ref', syn)
+            h.setpointer(self.next._ref_x[k], 'no_ref_next', syn)
+            h.setpointer(self.times._ref_x[0], 'no_tref0', syn)
+            h.setpointer(self.times._ref_x[1], 'no_tref1', syn)
+            syn.use_ptr = 2 if self.interp == 'linear' else 1
+
+    def attach_sources(self, srcs, targets):
+        for src, k in zip(srcs, targets):
+            h.setpointer(self.cur._ref_x[int(k)], 'no_ref', src)
+            src.use_ptr = 1
+
+    def update(self, t0, t1, prev, grid, idx=None):
+        """Copy the chunk's values (all of them, or just the entries idx) into the mirror."""
+        if idx is None:
+            self._cur[:] = prev
+            self._next[:] = grid
+        else:
+            self._cur[idx] = prev[idx]
+            self._next[idx] = grid[idx]
+        self._times[:] = (t0, t1)
+
+
+def counter_uniform(keys, stream, draw):
+    """Uniforms in [0, 1) from splitmix64 of (key, stream, draw), vectorized.
+
+    The splitmix64 mix of NOPoisson (mod_old/no_poisson.mod) with the sync number added as
+    a second stream term, so the sequences differ from NOPoisson's. A driver's draws
+    depend only on its key (from its gid), the sync number and the draw number, not on
+    rank count or loop order.
+    """
+    with np.errstate(over='ignore'):
+        z = (np.asarray(keys, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+             + np.uint64(stream) * np.uint64(0xD1B54A32D192ED03)
+             + np.asarray(draw, dtype=np.uint64) + np.uint64(0x632BE59BD9B4E019))
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) * (1.0 / 9007199254740992.0)
+
+
+class PoissonBatch:
+    """All NO-driven Poisson drivers of a rank, drawn as vectors and delivered through BatchStims.
+
+    Per sync, drive() draws every driver's count for [t0, t1) in one vectorized call and
+    all event times in a second; each driver with events gets its BatchStim vector
+    (mod_old/batchstim.mod) refilled and re-armed by a single event, instead of one
+    nc.event() per spike. The drawn times are arrival times at the synapse: the stim fires
+    delay earlier, so with delay > 0 each sync covers arrivals in [t0, t1) + delay.
+    """
+
+    def __init__(self, keys, syns, rate_fn, weight=1.0, delay=0.0):
+        self.keys = np.asarray(keys, dtype=np.uint64)
+        self.rate_fn = rate_fn              # NO (nM) array -> rate (Hz) array
+        self.delay = float(delay)
+        self.stims, self.vecs, self.ncs, self.kicks = [], [], [], []
+        for syn in syns:
+            vs, vec = h.BatchStim(), h.Vector()
+            vs.play(vec)
+            nc = h.NetCon(vs, syn)
+            nc.weight[0] = weight
+            nc.delay = delay
+            self.stims.append(vs)
+            self.vecs.append(vec)
+            self.ncs.append(nc)
+            self.kicks.append(h.NetCon(None, vs))
+        self.n_sync = 0
+        self.n_events = 0
+
+    def drive(self, t0, t1, NO):
+        """Draw and queue one chunk's events (arriving in [t0, t1) + delay) given each driver's NO (nM)."""
+        window = t1 - t0
+        mu = self.rate_fn(np.asarray(NO, dtype=float)) * window * 1e-3
+        n = np.maximum(poisson.ppf(counter_uniform(self.keys, self.n_sync, 0), mu), 0).astype(np.int64)
+        active = np.flatnonzero(n)
+        if active.size:
+            counts = n[active]
+            owner = np.repeat(active, counts)
+            draw = np.arange(owner.size) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+            arrive = t0 + self.delay + counter_uniform(self.keys[owner], self.n_sync, draw) * window
+            arrive = arrive[np.lexsort((arrive, owner))]
+            for i, ts in zip(active, np.split(arrive, np.cumsum(counts)[:-1])):
+                self.vecs[i].from_python(ts - self.delay)   # fire so the NetCon delivers at ts
+                self.kicks[i].event(t0)     # BatchStim replays its refilled vector from t0
+            self.n_events += int(counts.sum())
+        self.n_sync += 1
+
+
+def set_syn_no(syn, idx, t0, t1, prev, grid, interp='hold'):
+    """Drive one MyExp2SynBB_NO over [t0, t1]: hold prev, or ramp linearly from prev to grid."""
+    syn.no_local = float(prev[idx])
+    if interp == 'linear':
+        syn.no_t0 = t0
+        syn.no_slope = float(grid[idx] - prev[idx]) / (t1 - t0)
@@ -0,0 +1,148 @@
+import numpy as np
+from scipy import sparse
+
+"""
+Geometry of the NO lattice, shared by init.py, the field backends and the plotting helpers.
+
+Voxel (ix, iy, iz) sits at origin + grid*(ix, iy, iz). Grids are stored [iz, iy, ix]
+and flattened with flat = (iz*ny + iy)*nx + ix (C order, as .ravel() gives).
+Every mapping accepts scalars or NumPy arrays, so whole populations are indexed at once.
+"""
+
+
+class LatticeSpec:
+    """Regular nx*ny*nz lattice with spacing grid (µm) starting at origin."""
+
+    def __init__(self, nx, ny, nz, grid, origin=(0, 0, 0)):
+        self.nx, self.ny, self.nz = int(nx), int(ny), int(nz)
+        self.grid = grid
+        self.origin = tuple(origin)
+        self.shape = (self.nz, self.ny, self.nx)
+        self.size = self.nx * self.ny * self.nz
+        self.xs = [origin[0] + grid*i for i in range(self.nx)]
+        self.ys = [origin[1] + grid*i for i in range(self.ny)]
+        self.zs = [origin[2] + grid*i for i in range(self.nz)]
+
+    @classmethod
+    def from_box(cls, box, grid):
+        """Voxels at 0, grid, ... up to each side of box (µm), like range(0, side+1, grid)."""
+        n = [int(side // grid) + 1 for side in box]
+        return cls(n[0], n[1], n[2], grid)
+
+    def slab(self, z0, z1):
+        """Sub-lattice of z-planes z0..z1-1."""
+        return LatticeSpec(self.nx, self.ny, z1 - z0, self.grid,
+                           (self.origin[0], self.origin[1], self.zs[z0]))
+
+    # ---------- position <-> index ----------
+    def pos_to_idx(self, x, y, z):
+        """Nearest voxel (ix, iy, iz) of positions, clamped into the lattice."""
+        return (self._axis_idx(x, 0, self.nx),
+                self._axis_idx(y, 1, self.ny),
+                self._axis_idx(z, 2, self.nz))
+
+    def _axis_idx(self, v, axis, n):
+        i = np.clip(np.rint((np.asarray(v, dtype=float) - self.origin[axis]) / self.grid), 0, n - 1)
+        return i.astype(np.int64) if i.ndim else int(i)
+
+    def flat(self, ix, iy, iz):
+        return (iz*self.ny + iy)*self.nx + ix
+
+    def unflat(self, flat):
+        iz, iy, ix = np.unravel_index(flat, self.shape)
+        return ix, iy, iz
+
+    def pos_to_flat(self, x, y, z):
+        return self.flat(*self.pos_to_idx(x, y, z))
+
+    def positions(self, flat=None):
+        """(x, y, z) coordinates of the given flat indices (default: every voxel)."""
+        ix, iy, iz = self.unflat(np.arange(self.size) if flat is None else flat)
+        return (self.origin[0] + self.grid*ix,
+                self.origin[1] + self.grid*iy,
+                self.origin[2] + self.grid*iz)
+
+    def contains(self, x, y, z):
+        """True where positions fall inside the lattice (before clamping)."""
+        inside = True
+        for v, axis, n in ((x, 0, self.nx), (y, 1, self.ny), (z, 2, self.nz)):
+            i = np.rint((np.asarray(v, dtype=float) - self.origin[axis]) / self.grid)
+            inside = inside & (i >= 0) & (i <= n - 1)
+        return inside
+
+    def box_mask(self, lo, hi):
+        """Boolean [iz, iy, ix] map of voxels whose centers lie in the box lo..hi (µm, inclusive)."""
+        x, y, z = (np.asarray(v).reshape(self.shape) for v in self.positions())
+        return ((x >= lo[0]) & (x <= hi[0]) & (y >= lo[1]) & (y <= hi[1]) &
+                (z >= lo[2]) & (z <= hi[2]))
+
+    def cell_flat(self, cells):
+        """Flat voxel index of each cell's soma (NetPyNE cells with tags x, y, z)."""
+        xyz = np.array([(c.tags['x'], c.tags['y'], c.tags['z']) for c in cells], dtype=float).reshape(-1, 3)
+        return self.pos_to_flat(xyz[:, 0], xyz[:, 1], xyz[:, 2])
+
+    # ---------- interpolation ----------
+    def interpolation_operator(self, x, y, z, method='trilinear'):
+        """CSR matrix (n_points, size) sampling a flat grid at positions: W @ grid.
+
+        'trilinear' weights the 8 surrounding voxels (positions clamped into the lattice),
+        'nearest' picks the pos_to_flat voxel. Built once; each sync is one sparse mat-vec.
+        """
+        x, y, z = (np.atleast_1d(np.asarray(v, dtype=float)) for v in (x, y, z))
+        npts = x.size
+        if method == 'nearest':
+            return sparse.csr_matrix((np.ones(npts), (np.arange(npts), self.pos_to_flat(x, y, z))),
+                                     shape=(npts, self.size))
+        if method != 'trilinear':
+            raise ValueError(f"unknown interpolation method '{method}'")
+        lo, frac = [], []
+        for v, axis, n in ((x, 0, self.nx), (y, 1, self.ny), (z, 2, self.nz)):
+            f = np.clip((v - self.origin[axis]) / self.grid, 0, n - 1)
+            i0 = np.minimum(np.floor(f), max(n - 2, 0)).astype(np.int64)
+            lo.append(i0)
+            frac.append(f - i0)
+        rows, cols, vals = [], [], []
+        for cx in (0, 1):
+            for cy in (0, 1):
+                for cz in (0, 1):
+                    w = ((frac[0] if cx else 1 - frac[0]) *
+                         (frac[1] if cy else 1 - frac[1]) *
+                         (frac[2] if cz else 1 - frac[2]))
+                    ix = np.minimum(lo[0] + cx, self.nx - 1)
+                    iy = np.minimum(lo[1] + cy, self.ny - 1)
+                    iz = np.minimum(lo[2] + cz, self.nz - 1)
+                    rows.append(np.arange(npts))
+                    cols.append(self.flat(ix, iy, iz))
+                    vals.append(w)
+        W = sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                              shape=(npts, self.size))
+        W.eliminate_zeros()
+        return W
+
+    # ---------- coefficients ----------
+    def face_coefficients(self, D_phys, tortuosity=1.0):
+        """Per-face exchange rates (1/ms) from voxel maps of D_phys (µm²/ms) and tortuosity.
+
+        Both may be scalars or [iz, iy, ix] arrays. D_eff = D_phys / tortuosity², and each
+        interior face uses the harmonic mean of the two voxels' D_eff (the series
+        conductance, so the exchange is symmetric and conserves mass) divided by grid².
+        Returns a dict of dx_pos ... dz_neg arrays for set_coefficients().
+        """
+        D_eff = np.broadcast_to(np.asarray(D_phys, dtype=float) / np.asarray(tortuosity, dtype=float)**2,
+                                self.shape)
+        faces = {}
+        for axis, pos, neg in ((2, 'dx_pos', 'dx_neg'), (1, 'dy_pos', 'dy_neg'), (0, 'dz_pos', 'dz_neg')):
+            lo = [slice(None)] * 3
+            hi = [slice(None)] * 3
+            lo[axis] = slice(None, -1)
+            hi[axis] = slice(1, None)
+            lo, hi = tuple(lo), tuple(hi)
+            a, b = D_eff[lo], D_eff[hi]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                face = np.where(a + b > 0, 2*a*b / (a + b), 0.0) / self.grid**2
+            # boundary faces are never used (neighbor = self), keep the voxel's own value
+            faces[pos] = D_eff / self.grid**2
+            faces[neg] = D_eff / self.grid**2
+            faces[pos][lo] = face
+            faces[neg][hi] = face
+        return faces
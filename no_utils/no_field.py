@@ -0,0 +1,625 @@
+from neuron import h
+from scipy.fft import dctn, idctn
+import numpy as np
+import weakref
+
+"""
+Array-backed NO lattice.
+
+Same equations as mod_old/no_diffusion.mod, but the whole grid lives in contiguous
+NumPy arrays (indexed [iz, iy, ix], so .ravel() matches LatticeSpec.flat)
+and the 7-point stencil is stepped in one vectorized pass:
+
+    dC/dt = sum_faces d_face*(C_neighbor - C) - lam*C + F
+
+Boundaries reflect (neighbor = self), exactly like the self-pointers used with no_voxel.
+
+NOField integrators: 'cnexp' (what no_voxel does, stable only for small dt), 'adi'
+(Douglas ADI, unconditionally stable) so the field can run at its own no_dt,
+operator-split from the cell integration, and 'spectral' (exact in the DCT domain,
+homogeneous D and lam only), which jumps quiet intervals in a single step. With
+active_tol, 'cnexp' only updates the bounding box of voxels above tolerance (plus
+sources), grown by one voxel per step, so a mostly quiet lattice costs in proportion
+to its active volume.
+
+MODLattice exposes the same (x, y, z) access on top of the compiled no_lattice mechanism.
+"""
+
+FACES = ('dx_pos', 'dx_neg', 'dy_pos', 'dy_neg', 'dz_pos', 'dz_neg')
+COEFFS = FACES + ('lam', 'F', 'conc0')   # same order as no_lattice.set_field()
+
+
+def _weak_method(obj, name):
+    # callback for HOC handlers that does not keep obj alive (a bound method would pin it
+    # through the handler forever, and every later finitialize would still reach it)
+    ref = weakref.ref(obj)
+
+    def call():
+        target = ref()
+        if target is not None:
+            getattr(target, name)()
+    return call
+
+
+def _array_attr(name):
+    def fget(self):
+        return float(getattr(self._field, name)[self._idx])
+
+    def fset(self, value):
+        getattr(self._field, name)[self._idx] = value
+        self._field._factors = None
+    return property(fget, fset)
+
+
+class _Voxel:
+    # lightweight stand-in for a single no_voxel point process
+    def __init__(self, field, idx):
+        self._field = field
+        self._idx = idx
+
+    conc = _array_attr('conc')
+    conc0 = _array_attr('conc0')
+    F = _array_attr('F')
+    lam = _array_attr('lam')
+    dx_pos = _array_attr('dx_pos')
+    dx_neg = _array_attr('dx_neg')
+    dy_pos = _array_attr('dy_pos')
+    dy_neg = _array_attr('dy_neg')
+    dz_pos = _array_attr('dz_pos')
+    dz_neg = _array_attr('dz_neg')
+
+
+class _MechVoxel:
+    # same stand-in for one voxel of a no_lattice mechanism
+    def __init__(self, lattice, i):
+        self._mech = lattice.mech
+        self._i = i
+
+    def __getattr__(self, name):
+        if name in ('conc', 'conc0', 'F', 'lam'):
+            return getattr(self._mech, 'get_' + name)(self._i)
+        if name in FACES:
+            return self._mech.get_D(self._i, FACES.index(name))
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in ('conc', 'conc0', 'F', 'lam'):
+            getattr(self._mech, 'set_' + name)(self._i, value)
+        elif name in FACES:
+            self._mech.set_D(self._i, FACES.index(name), value)
+        else:
+            object.__setattr__(self, name, value)
+
+
+class _Lattice:
+    # (x, y, z) keyed, dict-like access shared by the lattice backends (geometry: LatticeSpec)
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.xs, self.ys, self.zs = spec.xs, spec.ys, spec.zs
+        self.nx, self.ny, self.nz = spec.nx, spec.ny, spec.nz
+        self.shape = spec.shape
+        self.size = spec.size
+
+    def index(self, key):
+        ix, iy, iz = self.spec.pos_to_idx(*key)
+        return iz, iy, ix
+
+    def flat_index(self, key):
+        return self.spec.pos_to_flat(*key)
+
+    def __contains__(self, key):
+        return bool(self.spec.contains(*key))
+
+    def set_diffusion(self, D_phys, tortuosity=1.0):
+        """All face coefficients at once from scalar or [iz, iy, ix] maps (see LatticeSpec.face_coefficients)."""
+        self.set_coefficients(**self.spec.face_coefficients(D_phys, tortuosity))
+
+    def set_decay(self, lam=None, t_half=None):
+        """Decay rate lam (1/ms), or from half-life t_half (ms); scalars or [iz, iy, ix] maps."""
+        if lam is None:
+            lam = np.log(2) / np.asarray(t_half, dtype=float)
+        self.set_coefficients(lam=lam)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return [(x, y, z) for x in self.xs for y in self.ys for z in self.zs]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+
+class MODLattice(_Lattice):
+    """Whole lattice in one no_lattice mechanism (mod_old/no_lattice.mod) hosted on sec(0.5).
+
+    The mechanism steps with the cells, so its grid is always at the cells' time: under
+    MultiRateScheduler the grids of a chunk [t0, t1] are those of t0 - no_dt and t0 (one
+    sync behind, as with overlap), and recorded samples are labelled t0. Played F
+    schedules (play_F) are applied at each advance() and held over the chunk.
+    """
+
+    steps_with_cells = True
+
+    def __init__(self, spec, sec):
+        super().__init__(spec)
+        self.mech = h.no_lattice(sec(0.5))
+        self.mech.setup(self.nx, self.ny, self.nz)
+        self._vec = h.Vector(self.size)
+        self._sources = []  # (flat idx, tvec, fvec, continuous) played into F
+
+    def __getitem__(self, key):
+        return _MechVoxel(self, self.flat_index(key))
+
+    def set_coefficients(self, **values):
+        """Bulk-assign any of COEFFS from scalars or (nz, ny, nx) arrays."""
+        for name, value in values.items():
+            which = COEFFS.index(name)
+            if np.ndim(value) == 0:
+                self.mech.set_all(which, float(value))
+            else:
+                arr = np.broadcast_to(np.asarray(value, dtype=float), self.shape)
+                self.mech.set_field(which, h.Vector(arr.ravel()))
+
+    def set_F_at(self, flat_idx, values):
+        """Set F (nM/ms) of just the voxels flat_idx."""
+        for i, v in zip(np.asarray(flat_idx).tolist(), np.broadcast_to(values, np.shape(flat_idx)).tolist()):
+            self.mech.set_F(i, v)
+
+    def snapshot(self):
+        return None   # the grid moves with the cells, nothing to undo before they run
+
+    def restore(self, state):
+        pass
+
+    def play_F(self, key, tvec, fvec, continuous=1):
+        """Like NOField.play_F, but F is set once per advance() (chunk midpoint, or its start
+        for continuous=0) and held until the next one."""
+        idx = self.flat_index(key)
+        self._sources.append((idx, np.array(tvec, dtype=float), np.array(fvec, dtype=float), continuous))
+
+    def advance(self, tstop):
+        # the lattice itself is stepped by NEURON with the cells (SOLVE advance in no_lattice);
+        # here only the played F is set for the chunk h.t..tstop the cells are about to run
+        for idx, tvec, fvec, continuous in self._sources:
+            if continuous:
+                value = np.interp(0.5*(h.t + tstop), tvec, fvec)
+            else:
+                value = fvec[max(0, np.searchsorted(tvec, h.t, side='right') - 1)]
+            self.mech.set_F(idx, float(value))
+
+    @property
+    def conc(self):
+        # one C-level copy-out of the grid; shares the buffer of self._vec
+        self.mech.to_vector(self._vec)
+        return self._vec.as_numpy().reshape(self.shape)
+
+
+class NOField(_Lattice):
+    """NO lattice on a LatticeSpec; drop-in for the {(x,y,z): no_voxel} dict."""
+
+    def __init__(self, spec, dt=None, method='cnexp', theta=0.5, active_tol=None):
+        super().__init__(spec)
+
+        self.conc = np.zeros(self.shape)
+        for name in COEFFS:
+            setattr(self, name, np.zeros(self.shape))
+
+        self.dt = dt          # field step (ms); None -> follow h.dt
+        self.method = method  # 'cnexp' (as no_voxel), 'adi' (implicit, any dt) or 'spectral'
+        self.theta = theta    # adi only: 0.5 Crank-Nicolson-like, 1.0 backward Euler
+        self.active_tol = active_tol  # cnexp only: step just the box where |conc| > tol or F != 0
+        self._box = None
+        self.t = 0.0
+        self._factors = None
+        self._sources = []  # (flat idx, tvec, fvec, continuous) played into F
+        self._F_idx = np.empty(0, dtype=np.int64)  # voxels whose F was set with set_F_at
+        self._rec_step = None
+        self._next_rec = 0.0
+        self._rec_t = []
+        self._rec = []
+        self._host = None
+        self._fih = h.FInitializeHandler(1, _weak_method(self, 'reinit'))
+
+    def __getitem__(self, key):
+        return _Voxel(self, self.index(key))
+
+    def set_coefficients(self, **values):
+        """Bulk-assign any of COEFFS from scalars or (nz, ny, nx) arrays."""
+        for name, value in values.items():
+            if name not in COEFFS:
+                raise ValueError(f"unknown NO field coefficient '{name}'")
+            getattr(self, name)[...] = value
+        self._factors = None
+
+    # ---------- sources / recording ----------
+    def set_F_at(self, flat_idx, values):
+        """Set F (nM/ms) of just the voxels flat_idx, e.g. from spike-driven production."""
+        flat_idx = np.asarray(flat_idx, dtype=np.int64)
+        self.F.reshape(-1)[flat_idx] = values
+        self._F_idx = np.union1d(self._F_idx[self.F.flat[self._F_idx] != 0], flat_idx)
+
+    def play_F(self, key, tvec, fvec, continuous=1):
+        """Equivalent of fvec.play(voxel._ref_F, tvec, continuous) for the voxel at key."""
+        idx = self.flat_index(key)
+        self._sources.append((idx, np.array(tvec, dtype=float), np.array(fvec, dtype=float), continuous))
+
+    def _apply_sources(self, t):
+        F = self.F.reshape(-1)
+        for idx, tvec, fvec, continuous in self._sources:
+            if continuous:
+                F[idx] = np.interp(t, tvec, fvec)
+            else:
+                F[idx] = fvec[max(0, np.searchsorted(tvec, t, side='right') - 1)]
+
+    def snapshot(self):
+        """Integration state for restore(), e.g. to redo a rejected chunk."""
+        return self.conc.copy(), self.t, self._box, self._next_rec, len(self._rec_t)
+
+    def restore(self, state):
+        conc, self.t, self._box, self._next_rec, n_rec = state
+        self.conc[:] = conc
+        del self._rec_t[n_rec:], self._rec[n_rec:]
+
+    def record(self, step):
+        """Keep a copy of the whole grid every `step` ms (see recorded())."""
+        self._rec_step = step
+
+    def recorded(self):
+        return np.array(self._rec_t), np.array(self._rec).reshape((-1,) + self.shape)
+
+    def _sample(self):
+        if self._rec_step is None:
+            return
+        while self.t >= self._next_rec - 1e-9:
+            self._rec_t.append(self._next_rec)
+            self._rec.append(self.conc.copy())
+            self._next_rec += self._rec_step
+
+    # ---------- integration ----------
+    def reinit(self):
+        self.conc[:] = self.conc0
+        self.t = 0.0
+        self._factors = None
+        self._rec_t, self._rec = [], []
+        self._next_rec = 0.0
+        self._apply_sources(self.t)
+        if self.active_tol is not None:
+            self.reset_active()
+        self._sample()
+
+    def attach(self, sec):
+        """Step the field inside NEURON's fixed-step loop via a beforestep_callback on sec(0.5)."""
+        self._host = h.beforestep_callback(sec(0.5))
+        self._host.set_callback(_weak_method(self, '_before_step'))
+
+    def _before_step(self):
+        self.advance(h.t + h.dt)
+
+    def advance(self, tstop):
+        """Take whole field steps of self.dt (or h.dt) up to tstop; the field holds in between."""
+        dt = self.dt or h.dt
+        if self.method == 'spectral' and self._rec_step is None and self._quiet(self.t, tstop):
+            # exact solver and nothing switching on: jump the whole interval in one step
+            n = int((tstop - self.t) / dt + 1e-9)
+            if n > 1:
+                self.step(n*dt)
+        while self.t + dt <= tstop + 1e-9:
+            self.step(dt)
+
+    def step(self, dt):
+        if self.method == 'spectral':
+            self._step_spectral(dt)
+        elif self.method == 'adi':
+            self._step_adi(dt)
+        else:
+            self._step_cnexp(dt)
+        self.t += dt
+        self._sample()
+
+    def _step_cnexp(self, dt):
+        self._apply_sources(self.t)
+        if self.active_tol is None:
+            self.conc[:] = self._cnexp((slice(None),) * 3, dt)
+            return
+
+        # only touch the active box grown by one voxel (all the stencil can reach in one
+        # step); read one more voxel around that so every written voxel sees real neighbors
+        box = self._grow_box(self._box, self._source_box())
+        if box is None:
+            return
+        write = tuple(slice(max(l - 1, 0), min(u + 1, n)) for l, u, n in zip(*box, self.shape))
+        read = tuple(slice(max(w.start - 1, 0), min(w.stop + 1, n)) for w, n in zip(write, self.shape))
+        inner = tuple(slice(w.start - r.start, w.stop - r.start) for w, r in zip(write, read))
+        self.conc[write] = self._cnexp(read, dt)[inner]
+        self._box = self._find_box(write)
+
+    def _cnexp(self, region, dt):
+        # new concentrations for the sub-block `region` (reflecting at the block edges)
+        c = self.conc[region]
+
+        # a = sum_faces d*C_neighbor + F,  b = sum_faces d + lam  (boundary faces cancel)
+        a = self.F[region].copy()
+        b = self.lam[region].copy()
+        for axis, pos, neg in self._axes():
+            lo, hi = _faces(axis)
+            pos, neg = pos[region], neg[region]
+            a[lo] += pos[lo] * c[hi]
+            b[lo] += pos[lo]
+            a[hi] += neg[hi] * c[lo]
+            b[hi] += neg[hi]
+
+        # cnexp update with neighbors held over the step (as no_diffusion.mod does)
+        decay = np.exp(-b * dt)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c_inf = np.where(b > 0, a / b, 0.0)
+        return np.where(b > 0, c_inf + (c - c_inf) * decay, c + a * dt)
+
+    # ---------- active region (cnexp with active_tol) ----------
+    def reset_active(self):
+        """Recompute the active box from the whole grid (call after writing conc/F directly)."""
+        self._box = self._find_box((slice(None),) * 3)
+
+    def _find_box(self, region):
+        # bounding box (lo, hi per axis) of |conc| > tol or F != 0 inside region, or None
+        active = (np.abs(self.conc[region]) > self.active_tol) | (self.F[region] != 0)
+        if not active.any():
+            return None
+        lo, hi = [], []
+        for axis, r in enumerate(region):
+            other = tuple(i for i in range(3) if i != axis)
+            idx = np.flatnonzero(active.any(axis=other))
+            start = r.start or 0
+            lo.append(start + idx[0])
+            hi.append(start + idx[-1] + 1)
+        return lo, hi
+
+    def _source_box(self):
+        # voxels whose played F is currently on
+        on = [idx for idx, *_ in self._sources if self.F.flat[idx] != 0]
+        on += [int(i) for i in self._F_idx[self.F.flat[self._F_idx] != 0]]
+        if not on:
+            return None
+        zyx = np.unravel_index(on, self.shape)
+        return [int(i.min()) for i in zyx], [int(i.max()) + 1 for i in zyx]
+
+    @staticmethod
+    def _grow_box(a, b):
+        if a is None or b is None:
+            return a or b
+        return [min(i, j) for i, j in zip(a[0], b[0])], [max(i, j) for i, j in zip(a[1], b[1])]
+
+    def _step_adi(self, dt):
+        # Douglas ADI: explicit predictor with the full operator, then one tridiagonal
+        # correction per axis (theta=0.5 ~ Crank-Nicolson, theta=1 ~ backward Euler).
+        # Unconditionally stable, so dt can be much larger than the cell dt.
+        # The decay is split evenly over the three axis operators.
+        self._apply_sources(self.t + 0.5*dt)
+        if self._factors is None or self._factors[0] != dt:
+            self._factors = (dt, [self._factorize(axis, pos, neg, dt) for axis, pos, neg in self._axes()])
+
+        u = self.conc
+        Au = [self._apply_axis(u, axis, pos, neg) for axis, pos, neg in self._axes()]
+        v = u + dt*(Au[0] + Au[1] + Au[2] + self.F)
+        for (axis, lower, cp, inv_m), Ai_u in zip(self._factors[1], Au):
+            v = _thomas(lower, cp, inv_m, v - self.theta*dt*Ai_u, axis)
+        u[:] = v
+
+    def _step_spectral(self, dt):
+        # exact for homogeneous D and lam: the reflecting stencil is diagonal in the DCT-II
+        # basis, so each mode evolves as c' = L_k c + F_k with F held over the step
+        self._apply_sources(self.t + 0.5*dt)
+        if self._factors is None or self._factors[0] != dt:
+            L = self._spectrum()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                gain = np.where(L != 0, np.expm1(L*dt) / L, dt)
+            self._factors = (dt, (np.exp(L*dt), gain))
+        expL, gain = self._factors[1]
+        c_hat = dctn(self.conc, type=2, norm='ortho')
+        c_hat = expL*c_hat + gain*dctn(self.F, type=2, norm='ortho')
+        self.conc[:] = idctn(c_hat, type=2, norm='ortho')
+
+    def _spectrum(self):
+        # eigenvalues of the lattice operator; needs one D per axis and a uniform lam
+        L = np.full(self.shape, -float(self.lam.flat[0]))
+        if not np.all(self.lam == self.lam.flat[0]):
+            raise ValueError("spectral NO solver needs a spatially uniform lam")
+        for axis, pos, neg in self._axes():
+            d = float(pos.flat[0])
+            if not (np.all(pos == d) and np.all(neg == d)):
+                raise ValueError("spectral NO solver needs one uniform D per axis")
+            n = self.shape[axis]
+            mu = -4.0*d*np.sin(np.pi*np.arange(n)/(2*n))**2
+            L += mu.reshape([n if i == axis else 1 for i in range(3)])
+        return L
+
+    def _quiet(self, t0, t1):
+        # True if F is zero now and no played source is nonzero anywhere in [t0, t1]
+        if np.any(self.F):
+            return False
+        for idx, tvec, fvec, continuous in self._sources:
+            inside = (tvec > t0) & (tvec < t1)
+            vals = np.concatenate([fvec[inside], np.interp([t0, t1], tvec, fvec)])
+            if np.any(vals != 0):
+                return False
+        return True
+
+    def _axes(self):
+        return ((2, self.dx_pos, self.dx_neg),
+                (1, self.dy_pos, self.dy_neg),
+                (0, self.dz_pos, self.dz_neg))
+
+    def _apply_axis(self, u, axis, pos, neg):
+        # one axis of the stencil plus a third of the decay, applied to u
+        lo, hi = _faces(axis)
+        out = -self.lam/3.0 * u
+        out[lo] += pos[lo] * (u[hi] - u[lo])
+        out[hi] += neg[hi] * (u[lo] - u[hi])
+        return out
+
+    def _factorize(self, axis, pos, neg, dt):
+        # LU (Thomas) factors of I - theta*dt*A_axis, with the solve axis moved to the front
+        k = self.theta * dt
+        lo, hi = _faces(axis)
+        lower = np.zeros(self.shape)
+        upper = np.zeros(self.shape)
+        lower[hi] = -k*neg[hi]
+        upper[lo] = -k*pos[lo]
+        diag = 1.0 + k*self.lam/3.0 - lower - upper
+        lower, upper, diag = (np.moveaxis(x, axis, 0) for x in (lower, upper, diag))
+
+        cp = np.empty_like(diag)
+        inv_m = np.empty_like(diag)
+        inv_m[0] = 1.0/diag[0]
+        cp[0] = upper[0]*inv_m[0]
+        for i in range(1, diag.shape[0]):
+            inv_m[i] = 1.0/(diag[i] - lower[i]*cp[i-1])
+            cp[i] = upper[i]*inv_m[i]
+        return axis, lower, cp, inv_m
+
+
+def _faces(axis):
+    # slices of the low / high voxel of every interior face normal to axis
+    lo = [slice(None)] * 3
+    hi = [slice(None)] * 3
+    lo[axis] = slice(None, -1)
+    hi[axis] = slice(1, None)
+    return tuple(lo), tuple(hi)
+
+
+def _thomas(lower, cp, inv_m, rhs, axis):
+    # vectorized tridiagonal solve along axis for every line of the grid at once
+    d = np.moveaxis(rhs, axis, 0).copy()
+    d[0] *= inv_m[0]
+    for i in range(1, d.shape[0]):
+        d[i] = (d[i] - lower[i]*d[i-1]) * inv_m[i]
+    for i in range(d.shape[0] - 2, -1, -1):
+        d[i] -= cp[i]*d[i+1]
+    return np.moveaxis(d, 0, axis)
+
+
+class DistributedNOField(_Lattice):
+    """NOField split into z-slabs across ranks; one-plane halos are exchanged before each step.
+
+    Every rank builds one of these (collective). Each rank steps only its own slab and
+    reads the voxels its synapses need through read_grid() after register_reads().
+    """
+
+    distributed = True
+
+    def __init__(self, pc, spec, dt=None, method='cnexp'):
+        super().__init__(spec)
+        if method != 'cnexp':
+            # the ADI z-sweep would need a tridiagonal solve spanning ranks
+            raise ValueError("DistributedNOField only supports method='cnexp'")
+        self.pc = pc
+        self.rank = int(pc.id())
+        self.nhost = int(pc.nhost())
+        if self.nz < self.nhost:
+            raise ValueError(f"cannot split {self.nz} z-planes over {self.nhost} ranks")
+
+        bounds = [len(a) for a in np.array_split(np.arange(self.nz), self.nhost)]
+        self.z_stops = np.cumsum(bounds)                   # exclusive end plane of each rank
+        self.z1 = int(self.z_stops[self.rank])
+        self.z0 = self.z1 - bounds[self.rank]
+
+        # local field = own planes plus one ghost plane on each interior side
+        self._lo = max(self.z0 - 1, 0)
+        self._hi = min(self.z1 + 1, self.nz)
+        self.local = NOField(spec.slab(self._lo, self._hi), dt=dt, method=method)
+        self._own = slice(self.z0 - self._lo, self.z1 - self._lo)
+
+        self._wanted = None   # flat indices this rank reads, per owner rank
+        self._serve = None    # flat indices each rank reads from this one
+        self._grid = None
+
+    @property
+    def t(self):
+        return self.local.t
+
+    def owns(self, key):
+        return self.z0 <= self.index(key)[0] < self.z1
+
+    def __getitem__(self, key):
+        if not self.owns(key):
+            raise KeyError(f"voxel {key} is not on rank {self.rank}")
+        return self.local[key]
+
+    def set_coefficients(self, **values):
+        """Same as NOField.set_coefficients; global (nz, ny, nx) arrays are sliced to the slab."""
+        for name, value in values.items():
+            if np.ndim(value) == 3:
+                value = np.asarray(value)[self._lo:self._hi]
+            self.local.set_coefficients(**{name: value})
+
+    def play_F(self, key, tvec, fvec, continuous=1):
+        if self.owns(key):
+            self.local.play_F(key, tvec, fvec, continuous)
+
+    def set_F_at(self, flat_idx, values):
+        """Same as NOField.set_F_at with global flat indices; voxels of other slabs are ignored."""
+        flat_idx = np.asarray(flat_idx, dtype=np.int64)
+        values = np.broadcast_to(values, flat_idx.shape)
+        plane = self.nx * self.ny
+        mine = (flat_idx >= self.z0 * plane) & (flat_idx < self.z1 * plane)
+        self.local.set_F_at(flat_idx[mine] - self._lo * plane, values[mine])
+
+    def snapshot(self):
+        return self.local.snapshot()
+
+    def restore(self, state):
+        self.local.restore(state)
+
+    def exchange_halos(self):
+        c = self.local.conc
+        own = c[self._own]
+        out = [None] * self.nhost
+        if self.z0 > 0:
+            out[self.rank - 1] = own[0].copy()
+        if self.z1 < self.nz:
+            out[self.rank + 1] = own[-1].copy()
+        got = self.pc.py_alltoall(out)
+        if self.z0 > 0:
+            c[0] = got[self.rank - 1]
+        if self.z1 < self.nz:
+            c[-1] = got[self.rank + 1]
+
+    def advance(self, tstop):
+        dt = self.local.dt or h.dt
+        while self.local.t + dt <= tstop + 1e-9:
+            self.exchange_halos()
+            self.local.step(dt)
+
+    def register_reads(self, flat_idx):
+        """Setup (collective): tell the owning ranks which voxels this rank reads."""
+        flat_idx = np.unique(np.asarray(flat_idx, dtype=np.int64))
+        owner = np.searchsorted(self.z_stops, flat_idx // (self.nx*self.ny), side='right')
+        self._wanted = [flat_idx[owner == r] for r in range(self.nhost)]
+        self._serve = self.pc.py_alltoall(self._wanted)
+        self._grid = np.zeros(self.size)
+
+    def read_grid(self):
+        """Flat grid with every registered voxel filled in (others stay 0)."""
+        own = self.local.conc[self._own].ravel()
+        offset = self.z0 * self.nx * self.ny
+        out = [own[idx - offset] if len(idx) else None for idx in self._serve]
+        got = self.pc.py_alltoall(out)
+        for r, idx in enumerate(self._wanted):
+            if len(idx):
+                self._grid[idx] = got[r]
+        return self._grid.copy()
+
+    def gather_grid(self):
+        """Full (nz, ny, nx) grid on rank 0 (None elsewhere), e.g. for recording."""
+        slabs = self.pc.py_gather(self.local.conc[self._own], 0)
+        return np.concatenate(slabs, axis=0) if self.rank == 0 else None
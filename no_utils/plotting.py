@@ -75,47 +75,23 @@ def voxel_net(sim):
     plt.savefig('figs/3Dnetfig.png')
 
 
-def conc_heat_map(sim, voxels):
-
-    # get all voxel coordinates and sort them for consistency
-    coords = list(voxels.keys())
-
-    # determine grid size and shape
-    xs = sorted(set([x for x, _, _ in coords]))
-    ys = sorted(set([y for _, y, _ in coords]))
-    zs = sorted(set([z for _, _, z in coords]))
-
-    sim.net.params.sizeX, sim.net.params.sizeY, sim.net.params.sizeZ = len(xs), len(ys), len(zs)
-
-    # map coords to array indices
-    coord_to_idx = {(x, y, z): (xs.index(x), ys.index(y), zs.index(z)) for (x, y, z) in coords}
-
-    # Compute global min and max across all voxels and all timepoints
-    all_conc = []
-    for key in voxels:
-        conc_vec = np.array(sim.simData[f"conc_{key}"])
-        all_conc.append(conc_vec)
-    all_conc = np.array(all_conc)
+def conc_heat_map(sim, lattice):
+    # sim.simData['no_conc'] holds the recorded grid as [t, iz, iy, ix] (NOField.recorded())
+    xs, ys, zs = lattice.xs, lattice.ys, lattice.zs
+    conc = np.asarray(sim.simData['no_conc'])
+    rec_t = np.asarray(sim.simData['no_t'])
 
     timepoints = [500, 550, 1000, 1500, 2000]
 
     for time in timepoints:
         time_ms = time   # or 1000, etc.
-        t_idx = (np.abs(sim.simData['t'] - time_ms)).argmin()  # nearest recorded index
-
-        # fill 3D array with final concentration values
-        conc_grid = np.zeros((sim.net.params.sizeX, sim.net.params.sizeY, sim.net.params.sizeZ))
-        for (x, y, z), vox in voxels.items():
-            idx = coord_to_idx[(x, y, z)]
-            conc_vec = np.array(sim.simData[f"conc_{(x, y, z)}"])
-            conc_grid[idx] = conc_vec[t_idx]
+        t_idx = (np.abs(rec_t - time_ms)).argmin()  # nearest recorded index
 
         plt.figure()
 
         mid_z = len(zs)//2
-        img = conc_grid[:, :, mid_z].T   # transpose so x→cols, y→rows
-        vals = conc_grid.flatten()
-        # vmin, vmax = np.percentile(vals, [0, 10])  # ignore outliers
+        img = conc[t_idx, mid_z]   # rows y, cols x
+        # vmin, vmax = np.percentile(img, [0, 10])  # ignore outliers
         plt.imshow(img, origin='lower', cmap='plasma',
                    # vmin=0, vmax=0.2,
                    extent=[xs[0], xs[-1], ys[0], ys[-1]])
@@ -128,32 +104,17 @@ def conc_heat_map(sim, voxels):
         plt.close()
 
 
-def max_conc_by_dist(sim, voxels):
-
-    x_voxels = range(55, 121, 11)  # select voxels from source to edge in any direction
-
-    # grab the actual concentration vectors for all of these locations
-    x_vox_section = {}
-    for vox in x_voxels:
-        x_vox_section[(vox, 55, 55)] = sim.simData[f"conc_({vox}, 55, 55)"]
-
-    # Grab max value from source
-    max = x_vox_section[(55, 55, 55)].max()
-
-    # normalize values to the max
-    norm_x_vox_section = {}
-    for vox in x_vox_section:
-        norm_x_vox_section[vox] = [x / max for x in x_vox_section[vox]]
+def max_conc_by_dist(sim, lattice):
+    # voxels from the center of the cube to the +x edge
+    conc = np.asarray(sim.simData['no_conc'])
+    cx, cy, cz = lattice.nx//2, lattice.ny//2, lattice.nz//2
+    x_section = conc[:, cz, cy, cx:]
 
-    # create a vector of distances from the center voxel for plotting
-    dist_vec = []
-    for vox in norm_x_vox_section:
-        dist_vec.append(vox[0] - 55)
+    # normalize the max in each voxel to the max at the source
+    conc_vec = x_section.max(axis=0) / x_section[:, 0].max()
 
-    # create a vector of the max normalized concentration value in each voxel
-    conc_vec = []
-    for max in norm_x_vox_section:
-        conc_vec.append(np.max(norm_x_vox_section[max]))
+    # distances from the center voxel for plotting
+    dist_vec = np.array(lattice.xs[cx:]) - lattice.xs[cx]
 
     fig = plt.figure()
     ax = fig.add_subplot(1, 1, 1)
@@ -161,6 +122,6 @@ def max_conc_by_dist(sim, voxels):
     ax.set_xlabel('distance (µm)')
     ax.set_xticks(np.arange(0, 56, 5))
     ax.set_ylabel('[NOmax]/[NOmax Global]')
-    ax.set_yticks(np.arrange(0, 1.1, 0.1))
+    ax.set_yticks(np.arange(0, 1.1, 0.1))
     ax.set_title('NO concentration over distance')
     fig.savefig('figs/NO_conc_by_dist.png')
@@ -1,5 +1,6 @@
 from netpyne import specs, sim
 from neuron import h, rxd
+from scipy import sparse
 import numpy as np
 
 """
@@ -16,11 +17,15 @@ Key knobs to sweep/optimize:
 This scaffold:
 - Builds a small population and places cells in 3D.
 - Creates a 3D ECS lattice with dx=DX_UM.
-- Creates NO species with d=0 (we supply operator via `rxd.Rate`).
+- RXD_BACKEND 'operator': NO species with d=0; the operator is supplied through one
+  rxd.Parameter refreshed per step and a single rxd.Rate over every ECS node.
+  RXD_BACKEND 'native': rxd's own ECS diffusion (d, tortuosity, zero-concentration
+  boundary) plus one source/decay Rate; only F is copied into the source parameter.
 - Computes D coefficients (s^-1) from D_eff/(dx_cm^2).
-- Uses a 6-neighbor stencil with open boundaries.
+- Uses a 6-neighbor stencil with open boundaries, prebuilt once as a scipy.sparse
+  operator H = neighbors - diag(sum D + lambda) and applied as one mat-vec on the
+  rxd state array.
 - Adds spike-driven NO sources (alpha pulses) into somatic voxels.
-- Feeds local NO back to cells (example: scales g_pas; swap to NMDA/HCN as needed).
 """
 
 # =====================
@@ -33,13 +38,12 @@ LAMBDA0_S    = 5.0            # baseline decay (s^-1)
 
 VOL_X_UM, VOL_Y_UM, VOL_Z_UM = 120.0, 120.0, 80.0  # volume dimensions
 
+RXD_BACKEND  = 'operator'     # 'operator' (H*C + F via one Rate) or 'native' (rxd ECS diffusion)
+
 # Spike source kernel (per spike into its soma voxel)
 TAU_NO_MS = 15.0
 A_NO      = 5e-5              # amplitude scaling (tune to land in ~10–50 nM peaks)
 
-# Feedback strength (example: leak scaling)
-ALPHA_LEAK = 5e-2
-
 # =====================
 # 1) NetPyNE config
 # =====================
@@ -110,23 +114,26 @@ XLO = -VOL_X_UM/2; XHI = VOL_X_UM/2
 YLO = -VOL_Y_UM/2; YHI = VOL_Y_UM/2
 ZLO = -VOL_Z_UM/2; ZHI = VOL_Z_UM/2
 
-ecs = rxd.Extracellular(XLO, YLO, ZLO, XHI, YHI, ZHI, dx=DX_UM)
-no  = rxd.Species(ecs, name='no', charge=0, d=0.0)  # disable built-in diffusion
-nodes = list(no.nodes)
-
-# Grid shape
-nx = int(ecs._nx) + 1
-ny = int(ecs._ny) + 1
-nz = int(ecs._nz) + 1
+if RXD_BACKEND == 'native':
+    # rxd diffuses with D_eff = d/tortuosity^2 itself; open boundaries as a 0 concentration bath
+    ecs = rxd.Extracellular(XLO, YLO, ZLO, XHI, YHI, ZHI, dx=DX_UM, tortuosity=TORT)
+    no  = rxd.Species(ecs, name='no', charge=0, d=D_PHYS_CM2_S * 1e5,   # cm^2/s -> µm^2/ms
+                      ecs_boundary_conditions=0)
+else:
+    ecs = rxd.Extracellular(XLO, YLO, ZLO, XHI, YHI, ZHI, dx=DX_UM)
+    no  = rxd.Species(ecs, name='no', charge=0, d=0.0)  # disable built-in diffusion
+
+# Grid shape of the rxd state array (concentrations indexed [i, j, k] = x, y, z)
+nx, ny, nz = no[ecs].states3d.shape
 M  = nx*ny*nz
 
-# Map each soma to its voxel index
+# Map each soma to its voxel index (C-order flat index of states3d)
 
 def voxel_index_of(x, y, z):
     i = int(round((x - ecs._xlo)/ecs._dx[0]))
     j = int(round((y - ecs._ylo)/ecs._dx[1]))
     k = int(round((z - ecs._zlo)/ecs._dx[2]))
-    return i + j*nx + k*nx*ny
+    return (i*ny + j)*nz + k
 
 voxel_index = [voxel_index_of(*p) for p in coords]
 
@@ -145,63 +152,55 @@ Dz_pos = np.full(M, Dcoef); Dz_neg = np.full(M, Dcoef)
 # Decay (can be spatially varying)
 lam = np.full(M, LAMBDA0_S)
 
-# Source vector (rebuilt each step)
+# Source vector (rebuilt each step), per ms like the rxd Rate it feeds
 F = np.zeros(M)
 
-# Neighbor helper (open boundaries)
-
-def nindex(ix, iy, iz, jx, jy, jz):
-    if not (0 <= jx < nx and 0 <= jy < ny and 0 <= jz < nz):
-        return None
-    return jx + jy*nx + jz*nx*ny
-
 # =====================
 # 4) Operator application: work = H*C + F
 # =====================
+def build_operator():
+    # H*C = sum_faces D_face*C_neighbor - (sum_faces D_face + lam)*C, open boundaries:
+    # faces leaving the grid only contribute to the diagonal
+    e = np.arange(M).reshape(nx, ny, nz)
+    rows, cols, vals = [], [], []
+    for axis, D_pos, D_neg in ((0, Dx_pos, Dx_neg), (1, Dy_pos, Dy_neg), (2, Dz_pos, Dz_neg)):
+        lo = [slice(None)]*3; hi = [slice(None)]*3
+        lo[axis] = slice(None, -1); hi[axis] = slice(1, None)
+        a, b = e[tuple(lo)].ravel(), e[tuple(hi)].ravel()   # b is a's + neighbor
+        rows += [a, b]; cols += [b, a]; vals += [D_pos[a], D_neg[b]]
+    off = sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(M, M))
+    diag = Dx_pos + Dx_neg + Dy_pos + Dy_neg + Dz_pos + Dz_neg + lam
+    return (off - sparse.diags(diag)).tocsr()
+
 work  = np.zeros(M)
 last_t = -1.0
 
+# the source (native) or H*C + F (operator) lives in one parameter on the same grid
+no_src = rxd.Parameter(ecs, name='no_src', value=0)
+if RXD_BACKEND == 'native':
+    # one source + decay reaction over every ECS node; diffusion is rxd's own
+    operator_rate = rxd.Rate(no, no_src - LAMBDA0_S * 1e-3 * no)   # s^-1 -> ms^-1
+else:
+    H = build_operator() * 1e-3   # s^-1 -> ms^-1 (rxd time is in ms); rebuild if D/lam change
+    operator_rate = rxd.Rate(no, no_src)   # one Rate adds H*C + F to every node
+
 
 def update_work():
-    C = np.fromiter((nd.concentration for nd in nodes), dtype=float, count=M)
-    w = - (Dx_pos + Dx_neg + Dy_pos + Dy_neg + Dz_pos + Dz_neg + lam) * C + F
-    for iz in range(nz):
-        for iy in range(ny):
-            row = iy*nx + iz*nx*ny
-            for ix in range(nx):
-                i = ix + row
-                # +x / -x
-                j = nindex(ix, iy, iz, ix+1, iy, iz)
-                if j is not None: w[i] += Dx_pos[i] * C[j]
-                j = nindex(ix, iy, iz, ix-1, iy, iz)
-                if j is not None: w[i] += Dx_neg[i] * C[j]
-                # +y / -y
-                j = nindex(ix, iy, iz, ix, iy+1, iz)
-                if j is not None: w[i] += Dy_pos[i] * C[j]
-                j = nindex(ix, iy, iz, ix, iy-1, iz)
-                if j is not None: w[i] += Dy_neg[i] * C[j]
-                # +z / -z
-                j = nindex(ix, iy, iz, ix, iy, iz+1)
-                if j is not None: w[i] += Dz_pos[i] * C[j]
-                j = nindex(ix, iy, iz, ix, iy, iz-1)
-                if j is not None: w[i] += Dz_neg[i] * C[j]
-    work[:] = w
-
-# One tiny Rate per node that reads from `work`
-
-def rhs_factory(i):
-    def rhs(node):
-        global last_t
-        if h.t != last_t:
-            update_work()
-            last_t = h.t
-        return work[i]
-    return rhs
-
-rates = [rxd.Rate(no, rhs_factory(i), regions=[nd.region]) for i, nd in enumerate(nodes)]
+    # one sparse mat-vec on the rxd state array (no per-node Python reads)
+    global last_t
+    if h.t == last_t:
+        return
+    last_t = h.t
+    if RXD_BACKEND == 'native':
+        work[:] = F
+    else:
+        work[:] = H @ no[ecs].states3d.reshape(-1) + F
+    no_src[ecs].states3d[:] = work.reshape(nx, ny, nz)
+
+h.CVode().extra_scatter_gather(0, update_work)   # refresh the source / operator once per time point
 
 # =====================
-# 5) Spike → source pulses; NO → feedback
+# 5) Spike → source pulses
 # =====================
 # # Record spikes per cell
 # spike_vecs = [h.Vector() for _ in sim.net.cells]
@@ -232,17 +231,9 @@ rates = [rxd.Rate(no, rhs_factory(i), regions=[nd.region]) for i, nd in enumerat
 #             keep.append((vidx, ts))
 #     active_spikes[:] = keep
 #
-# # Example feedback: scale g_pas at soma by local NO (swap to NMDA/HCN as desired)
-#
-# def apply_feedback():
-#     for i, cell in enumerate(sim.net.cells):
-#         NOi = nodes[voxel_index[i]].concentration
-#         cell.secs['soma']['hObj'].g_pas = 1e-4 * (1.0 + ALPHA_LEAK * NOi)
-#
 # def before_step():
 #     gather_new_spikes()
 #     rebuild_F()
-#     apply_feedback()
 #
 # cv = h.CVode()
 # h.CVode().extra_scatter_gather(before_step)